@@ -1,12 +1,21 @@
 from flask import Flask, request, Response, jsonify
 from src.descriptive.descriptive import Descriptive
-from src.predictive import Predictive
-from src.min_costs_icu_beds import run_model
+from src.predictive import get_default_predictive, contamination_job
+from src.min_costs_icu_beds import run_model, run_scenarios, prescriptive_job, OUTPUT_FORMATS
+from src.jobs import JobQueue
 
 app = Flask(__name__)
 
-descriptive = Descriptive()
-predictive = Predictive()
+# Job, tuning and backtest processes are started by a fork server and import this
+# module again as __mp_main__; only the web process loads the data and the models
+if __name__ != '__mp_main__':
+    descriptive = Descriptive()
+    predictive = get_default_predictive()
+
+    jobs = JobQueue({
+        "predict_contamination": contamination_job,
+        "prescriptive": prescriptive_job,
+    })
 
 @app.route('/', methods=['GET'])
 def handle_root():
@@ -31,10 +40,74 @@ def prescriptive():
     staff_rates = request_data.get("staff_rates")
     consumable_rates = request_data.get("consumable_rates")
 
-    response = run_model(demand, equipment_rates, staff_rates, consumable_rates)
+    # JSON when asked for with ?format=json or Accept: application/json, HTML otherwise
+    output = request.args.get("format")
+    if output is None:
+        best_match = request.accept_mimetypes.best_match(["text/html", "application/json"])
+        output = "json" if best_match == "application/json" else "html"
+    if output not in OUTPUT_FORMATS:
+        return jsonify({"error": "format must be one of " + ", ".join(OUTPUT_FORMATS)}), 400
+
+    response = run_model(demand, equipment_rates, staff_rates, consumable_rates, output=output)
 
+    if output == "json":
+        return Response(response, mimetype="application/json")
     return response
 
+@app.route('/prescriptive/batch', methods=['POST'])
+def prescriptive_batch():
+    request_data = request.get_json()
+
+    scenarios = request_data.get("scenarios", [])
+    full_solutions = request_data.get("full_solutions", False)
+
+    response = run_scenarios(scenarios, full_solutions)
+
+    return jsonify(response)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    request_data = request.get_json()
+
+    kind = request_data.get("kind")
+    params = request_data.get("params", {})
+    if kind not in jobs.functions:
+        return jsonify({"error": "unknown job kind"}), 400
+
+    job = jobs.submit(kind, params)
+
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job.status != "done":
+        return jsonify(job.to_dict()), 409
+
+    if not isinstance(job.result, str):
+        return jsonify(job.result)
+    if job.kind == "prescriptive" and job.params.get("output", "json") == "html":
+        return Response(job.result, mimetype="text/html")
+    return Response(job.result, mimetype="application/json")
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+
+    return jsonify(job.to_dict())
+
 @app.route('/describe_region', methods=['GET'])
 def describe_region():
     response = descriptive.describe_region_statistics()
@@ -0,0 +1,91 @@
+import os
+import copy
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from .model_store import ModelStore, data_path
+from .processes import context
+
+# Fold workers are started by the fork server: the pool is created right after the
+# regressors were trained in this process, and forking after their OpenMP thread
+# pools have run can hang LightGBM in the child
+_predictive = None
+
+def worker_predictive(predictive):
+    # The settings of predictive without its data: every fold comes with its own
+    # train and valid frames
+    worker = copy.copy(predictive)
+    worker.dataset = worker.train = worker.valid = None
+    return worker
+
+def init_worker(predictive):
+    global _predictive
+    _predictive = predictive
+
+def fit_fold(params, train, valid):
+    _predictive.model_threads = _predictive.NUM_THREADS
+    return _predictive.train_forecast(_predictive.models_(params), params['lags'], train, valid)
+
+class Backtest:
+    # Rolling-origin evaluation of the contamination forecaster: n_folds cutoffs
+    # spaced step days apart, each fold trained on the data up to its cutoff and
+    # scored on the following horizon days. Folds are fitted in parallel and their
+    # forecasts are stored, so evaluating the same params on the same data again
+    # does not refit anything.
+    def __init__(self, predictive, n_folds=4, horizon=None, step=None, max_workers=None,
+                 store=None):
+        self.predictive = predictive
+        self.n_folds = n_folds
+        self.horizon = horizon or predictive.valid_horizon
+        self.step = step or self.horizon
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 1) // predictive.NUM_THREADS)
+        self.store = store or ModelStore(os.path.join(data_path, 'backtests'), max_artifacts=64)
+
+    def cutoffs(self):
+        last = self.predictive.max_date - pd.Timedelta(days=self.horizon)
+        return [last - pd.Timedelta(days=self.step*k) for k in reversed(range(self.n_folds))]
+
+    def split(self, cutoff):
+        data = self.predictive.dataset.drop(columns=['death_cnt'])
+        train = data[data['ds'] <= cutoff]
+        valid = data[(data['ds'] > cutoff) & (data['ds'] <= cutoff + pd.Timedelta(days=self.horizon))]
+        return train, valid
+
+    def forecasts(self, params):
+        # Forecast of every fold, taken from the store or fitted in the pool
+        folds = {}
+        pending = {}
+        for cutoff in self.cutoffs():
+            train, valid = self.split(cutoff)
+            key = self.store.key('fold', params, pd.concat([train, valid]))
+            folds[cutoff] = self.store.load(key)
+            if folds[cutoff] is None:
+                pending[cutoff] = (key, train, valid)
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, len(pending)), mp_context=context,
+                                     initializer=init_worker, initargs=(worker_predictive(self.predictive),)) as executor:
+                futures = {cutoff: executor.submit(fit_fold, params, train, valid)
+                           for cutoff, (key, train, valid) in pending.items()}
+                for cutoff, future in futures.items():
+                    folds[cutoff] = future.result()
+                    self.store.save(pending[cutoff][0], folds[cutoff])
+        return folds
+
+    def evaluate(self, params):
+        # One row per fold, RA ('global' for all of them) and model with its wMAPE and MAE
+        tables = []
+        for fold, (cutoff, forecast) in enumerate(self.forecasts(params).items()):
+            metrics = pd.concat([
+                self.predictive.calculate_metrics_for_ra(forecast),
+                self.predictive.calculate_metrics_for_ra(forecast.assign(unique_id='global'))
+            ])
+            tables.append(metrics.assign(fold=fold, cutoff=cutoff))
+        return pd.concat(tables, ignore_index=True)[['fold', 'cutoff', 'unique_id', 'model', 'wmape', 'mae']]
+
+    def best_models(self, params, results=None):
+        # Per RA, the regressor with the lowest MAE averaged over the folds
+        if results is None:
+            results = self.evaluate(params)
+        ras = results[results['unique_id'] != 'global']
+        return self.predictive.select_best_models(ras.groupby(['unique_id', 'model'], as_index=False)['mae'].mean())
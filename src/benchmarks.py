@@ -0,0 +1,166 @@
+import sys
+import math
+import time
+import random
+import pyomo.environ as pyo
+
+from .min_costs_icu_beds import Data, Model, MatrixModel, transfer_arcs
+
+class SyntheticReader:
+  # Names used by the HTML report
+  def get_hospital_name(self, id):
+    return 'Hospital ' + str(id)
+
+  def get_equipment_name(self, id):
+    return 'Equipamento ' + str(id)
+
+  def get_staff_team(self, id):
+    return 'Equipe ' + str(id)
+
+  def get_consumable_name(self, id):
+    return 'Insumo ' + str(id)
+
+class SyntheticData:
+  # Random instance with the same attributes as min_costs_icu_beds.Data: 3 equipments,
+  # 3 staff teams and 3 consumables, about half of the facilities already built
+  def __init__(self, num_facilities, seed = 0):
+    rng = random.Random(seed)
+    self.F = list(range(num_facilities))
+    self.K = [i for i in self.F if i % 2 == 0]
+    self.R = [0, 1, 2]
+    self.U = [3, 4, 5, 6, 7, 8]
+    self.data_reader = SyntheticReader()
+    self.dict_hospitals = {i: i for i in self.F}
+    self.dict_equipments = {0: 0, 1: 1, 2: 2}
+    self.dict_staff = {3: 0, 4: 1, 5: 2}
+    self.dict_consumables = {6: 0, 7: 1, 8: 2}
+
+    self.n = [1, 1, 1, 14*0.5, 14*0.1, 14*0.1, 630, 180, 180]
+    self.p = [1500, 9000, 60000, 4000, 9000, 20000, 20, 15, 30]
+    self.r = [300, 1000, 5000]
+    self.c = [0 if i in self.K else rng.randint(5, 20)*10**6 for i in self.F]
+    self.l = [rng.randint(5, 10) for _ in self.F]
+    self.u = [rng.randint(20, 60) for _ in self.F]
+
+    self.a = []
+    self.m = []
+    for i in self.F:
+      if i in self.K:
+        beds = rng.randint(5, 20)
+        self.a.append([math.floor(beds*n*rng.uniform(0.5, 1.5)) for n in self.n])
+        self.m.append([rng.randint(0, 3) for _ in self.R])
+      else:
+        self.a.append([0]*len(self.n))
+        self.m.append([0]*len(self.R))
+
+    self.coords = [(rng.uniform(0, 100), rng.uniform(0, 100)) for _ in self.F]
+    self.t = [[[int(math.dist(self.coords[i], self.coords[l])) for l in self.F] for i in self.F]
+      for _ in self.R + self.U]
+    self.d = int(sum(min(a_row[j]/self.n[j] for j in self.R + self.U) for a_row in self.a)*1.3)
+
+  structure_key = Data.structure_key
+
+def bench_model_backends(sizes = (5, 10, 20, 40)):
+  # Build and solve times of the Pyomo and the matrix backends as F grows
+  print('{:>5} {:>8} {:>10} {:>10} {:>16}'.format('F', 'backend', 'build (s)', 'solve (s)', 'objective'))
+  for size in sizes:
+    data = SyntheticData(size)
+    for name, backend in (('pyomo', Model), ('matrix', MatrixModel)):
+      model = backend(data)
+      print('{:>5} {:>8} {:>10.3f} {:>10.3f} {:>16.2f}'.format(size, name, model.build_time,
+        model.solve_time, pyo.value(model.model.objective)))
+
+def bench_transfer_graph(sizes = (5, 10, 20, 40), k_nearest = 3):
+  # Model size and times of the complete, stock-only and k-nearest transfer networks.
+  # The first two must reach the same optimal cost.
+  graphs = (('complete', {'complete': True}), ('stock', {}), ('k=' + str(k_nearest),
+    {'k_nearest': k_nearest}))
+  print('{:>5} {:>9} {:>7} {:>10} {:>10} {:>16}'.format('F', 'graph', 'arcs', 'build (s)',
+    'solve (s)', 'objective'))
+  for size in sizes:
+    data = SyntheticData(size)
+    for name, graph in graphs:
+      model = MatrixModel(data, graph)
+      print('{:>5} {:>9} {:>7} {:>10.3f} {:>10.3f} {:>16.2f}'.format(size, name,
+        len(transfer_arcs(data, **graph)), model.build_time, model.solve_time,
+        pyo.value(model.model.objective)))
+
+def bench_render(sizes = (5, 10, 20, 40)):
+  # Solution extraction and HTML rendering next to the solve time
+  print('{:>5} {:>10} {:>12} {:>11} {:>10}'.format('F', 'solve (s)', 'extract (s)', 'render (s)',
+    'HTML (kB)'))
+  for size in sizes:
+    model = MatrixModel(SyntheticData(size))
+    start = time.perf_counter()
+    facilities = model.extract_solution()
+    extract_time = time.perf_counter() - start
+    html = model.to_html(facilities)
+    print('{:>5} {:>10.3f} {:>12.4f} {:>11.4f} {:>10.1f}'.format(size, model.solve_time, extract_time,
+      model.render_time, len(html)/1024))
+
+def bench_predictive_data(repeat = 5):
+  # Cold (parse and clean the CSV) against warm (read the cached parquet) loads of
+  # dados-gerais.csv. Imported here so that the other benchmarks do not need the
+  # forecasting dependencies.
+  import os
+  from .predictive import Predictive, data_path
+  predictive = Predictive.__new__(Predictive) # only get_data is needed, skip loading the models
+  path = os.path.join(data_path, 'dados-gerais.csv')
+  print('{:>6} {:>10}'.format('load', 'time (s)'))
+  for _ in range(repeat):
+    cache_file = predictive.preprocessed_file(path)
+    if os.path.exists(cache_file):
+      os.remove(cache_file)
+    start = time.perf_counter()
+    predictive.get_data(path)
+    print('{:>6} {:>10.4f}'.format('cold', time.perf_counter() - start))
+    start = time.perf_counter()
+    predictive.get_data(path)
+    print('{:>6} {:>10.4f}'.format('warm', time.perf_counter() - start))
+
+def bench_columnar(repeat = 5):
+  # Load time and in-memory size of dados-gerais.csv read as CSV (parsing dates)
+  # against its typed parquet copy: whole file, and two columns of the last 60 days.
+  # The parquet copy is written to a temporary directory.
+  import os
+  import tempfile
+  import pandas as pd
+  from . import columnar
+  from .predictive import data_path
+  csv_file = os.path.join(data_path, 'dados-gerais.csv')
+  frame = pd.read_csv(csv_file)
+  copy_file = os.path.join(tempfile.mkdtemp(), 'dados-gerais.csv')
+  columnar.write(frame, copy_file, 'cases')
+  last_date = pd.to_datetime(frame['date']).max()
+
+  def read_csv():
+    data = pd.read_csv(copy_file)
+    data['date'] = pd.to_datetime(data['date'])
+    return data
+
+  loads = (
+    ('csv', read_csv),
+    ('parquet', lambda: columnar.read(copy_file, 'cases')),
+    ('parquet 60d', lambda: columnar.read(copy_file, 'cases', columns=['date', 'case_cnt'],
+      start_date=last_date - pd.Timedelta(days=60))),
+  )
+  print('{:>12} {:>10} {:>8} {:>12}'.format('load', 'time (s)', 'rows', 'memory (kB)'))
+  for name, load in loads:
+    start = time.perf_counter()
+    for _ in range(repeat):
+      data = load()
+    print('{:>12} {:>10.4f} {:>8} {:>12.1f}'.format(name, (time.perf_counter() - start)/repeat, len(data),
+      data.memory_usage(deep=True).sum()/1024))
+
+BENCHMARKS = {
+  'model_backends': bench_model_backends,
+  'transfer_graph': bench_transfer_graph,
+  'render': bench_render,
+  'predictive_data': bench_predictive_data,
+  'columnar': bench_columnar,
+}
+
+if __name__ == '__main__':
+  # python -m src.benchmarks [<benchmark> ...]
+  for name in sys.argv[1:] or BENCHMARKS:
+    BENCHMARKS[name]()
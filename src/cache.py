@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .files import data_path, atomic_write
+
+class LRUCache:
+  def __init__(self, max_entries = 128):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key]
+      self.misses += 1
+      return None
+
+  def put(self, key, value):
+    with self.lock:
+      self.entries[key] = value
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  def stats(self):
+    with self.lock:
+      return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class SolutionCache(LRUCache):
+  # Prescriptive responses keyed by a hash of the normalized request and of the
+  # version of the input data. Entries live in memory (LRU) and, optionally, as
+  # files in disk_path so that they survive restarts.
+  def __init__(self, max_entries = 128, disk_path = os.path.join(data_path, 'solution_cache'),
+    max_disk_entries = 1024):
+    super().__init__(max_entries)
+    # Reentrant, and also held around the disk tier: check_version() may remove the
+    # directory that a concurrent put() is writing to
+    self.lock = threading.RLock()
+    self.disk_path = disk_path
+    self.max_disk_entries = max_disk_entries
+    self.version = None
+    if self.disk_path is not None:
+      os.makedirs(self.disk_path, exist_ok=True)
+      version_file = os.path.join(self.disk_path, 'VERSION')
+      if os.path.exists(version_file):
+        with open(version_file, 'r') as f:
+          self.version = f.read().strip() or None
+
+  def key(self, request, version):
+    content = json.dumps({"request": request, "version": version}, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+  def check_version(self, version):
+    # Drops every entry, in memory and on disk, once the input data changes
+    with self.lock:
+      if version != self.version:
+        self.invalidate()
+        self.version = version
+        if self.disk_path is not None:
+          with open(os.path.join(self.disk_path, 'VERSION'), 'w') as f:
+            f.write(version)
+
+  def invalidate(self):
+    with self.lock:
+      self.clear()
+      if self.disk_path is not None:
+        shutil.rmtree(self.disk_path, ignore_errors=True)
+        os.makedirs(self.disk_path, exist_ok=True)
+
+  def get(self, key):
+    with self.lock:
+      value = super().get(key)
+      if value is None and self.disk_path is not None:
+        file = os.path.join(self.disk_path, key)
+        if os.path.exists(file):
+          with open(file, 'r') as f:
+            value = f.read()
+          os.utime(file) # the modification time orders disk entries by last use
+          LRUCache.put(self, key, value)
+      return value
+
+  def put(self, key, value):
+    with self.lock:
+      super().put(key, value)
+      if self.disk_path is not None:
+        with atomic_write(os.path.join(self.disk_path, key)) as tmp_file:
+          with open(tmp_file, 'w') as f:
+            f.write(value)
+        self.evict_disk()
+
+  def evict_disk(self):
+    files = [os.path.join(self.disk_path, name) for name in os.listdir(self.disk_path)
+      if name != 'VERSION' and not name.endswith('.tmp')]
+    if len(files) <= self.max_disk_entries:
+      return
+    files.sort(key=os.path.getmtime)
+    for file in files[:len(files) - self.max_disk_entries]:
+      try:
+        os.remove(file)
+      except FileNotFoundError:
+        pass
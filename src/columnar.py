@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from .files import atomic_write
+except ImportError: # imported as a top-level module by create_data.py, run from src/
+    from files import atomic_write
+
+# Parquet copies of the CSV datasets, with typed columns: dates as date32, RAs
+# dictionary-encoded (categorical in pandas) and counts as integers. Each file is
+# written sorted by date in row groups, so date-range filters skip whole row groups.
+SCHEMAS = {
+    'cases': pa.schema([
+        ('date', pa.date32()),
+        ('ra', pa.dictionary(pa.int32(), pa.string())),
+        ('case_cnt', pa.int32()),
+        ('death_cnt', pa.int32()),
+    ]),
+    'forecast': pa.schema([
+        ('unique_id', pa.dictionary(pa.int32(), pa.string())),
+        ('ds', pa.date32()),
+        ('y_hat', pa.int32()),
+    ]),
+}
+DATE_COLUMNS = {'cases': 'date', 'forecast': 'ds'}
+ROW_GROUP_SIZE = 64*1024
+
+def parquet_path(csv_file):
+    return os.path.splitext(csv_file)[0] + '.parquet'
+
+def is_fresh(csv_file):
+    # Whether the parquet copy exists and is not older than the CSV
+    parquet_file = parquet_path(csv_file)
+    if not os.path.exists(parquet_file):
+        return False
+    return not os.path.exists(csv_file) or os.path.getmtime(parquet_file) >= os.path.getmtime(csv_file)
+
+def to_table(frame, kind):
+    schema = SCHEMAS[kind]
+    date_column = DATE_COLUMNS[kind]
+    frame = frame[schema.names].assign(**{date_column: pd.to_datetime(frame[date_column]).dt.date})
+    frame = frame.sort_values(date_column, kind='stable')
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+def write(frame, csv_file, kind, csv=True):
+    # Writes the parquet copy next to csv_file and, when csv is True, the CSV too.
+    # The parquet file is written last, so that it is never older than the CSV
+    if csv:
+        with atomic_write(csv_file) as tmp_file:
+            frame.to_csv(tmp_file, index=False)
+    with atomic_write(parquet_path(csv_file)) as tmp_file:
+        pq.write_table(to_table(frame, kind), tmp_file, row_group_size=ROW_GROUP_SIZE)
+
+def read(csv_file, kind, columns=None, start_date=None, end_date=None, memory_map=True):
+    # Reads only the given columns of the rows with start_date <= date <= end_date
+    # from the parquet copy of csv_file. Dates come back as datetime64 and RAs as
+    # categoricals.
+    date_column = DATE_COLUMNS[kind]
+    filters = []
+    if start_date is not None:
+        filters.append((date_column, '>=', pd.Timestamp(start_date).date()))
+    if end_date is not None:
+        filters.append((date_column, '<=', pd.Timestamp(end_date).date()))
+    table = pq.read_table(parquet_path(csv_file), columns=columns, filters=filters or None,
+                          memory_map=memory_map)
+    return table.to_pandas(date_as_object=False)
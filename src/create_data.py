@@ -1,20 +1,40 @@
-import sqlite3
 import pandas as pd
-from prettytable import from_db_cursor
 import re
-import subprocess
 import os
+import shutil
+import hashlib
 
-current_directory = os.path.dirname(os.path.abspath(__file__))
-data_path = os.path.join(current_directory, 'data')
+import create_db
+import columnar
+from files import data_path, atomic_write
 
+csv_file = create_db.CSV_FILE
 database_file = os.path.join(data_path, 'covid_data.db')
+output_file = os.path.join(data_path, 'dados-gerais.csv')
 
-if not os.path.exists(database_file) or os.path.getsize(database_file) == 0:
-    print('Criando banco de dados...')
-    subprocess.run(['python3', 'create_db.py'])
-else:
-    print('Banco de dados já existe')
+ras_to_exclude = ['entorno_df']
+TAIL_BYTES = 64*1024 # bytes before the loaded offset compared to tell an appended CSV from a replaced one
+
+# Cases and deaths per raw (date, ra), kept in daily_aggregates so that a refresh
+# only recomputes the groups that received new rows
+UPSERT_AGGREGATES = """
+insert into daily_aggregates (date, ra, case_cnt, death_cnt)
+select h.dataprimeirosintomas, h.ra, count(*),
+    sum(case when lower(trim(h.óbito)) != 'não' then 1 else 0 end)
+from {source}
+where h.dataprimeirosintomas is not null
+group by h.dataprimeirosintomas, h.ra
+on conflict (date, ra) do update set case_cnt = excluded.case_cnt, death_cnt = excluded.death_cnt
+"""
+ALL_ROWS = "historical_data h"
+AFFECTED_ROWS = "affected a join historical_data h on h.dataprimeirosintomas = a.date and h.ra = a.ra"
+
+EXPORT_AGGREGATES = """
+select 'brasilia' as country, lower(ra) as province, date, case_cnt, death_cnt
+from daily_aggregates
+where ra is not null and trim(ra) <> 'Não Informado' and trim(ra) <> '' {condition}
+order by date
+"""
 
 def remover_acentos(texto):
     substituicoes = {
@@ -47,29 +67,132 @@ def clean_names(name):
     return cleaned_name.replace('/', ' ').replace('2', 'II').lower().replace(' ', '_')
 
 
-# Conecte ao banco de dados
-conn = sqlite3.connect(database_file)
-
-# Crie um cursor
-c = conn.cursor()
-# Obtenha a consulta do arquivo query.sql
-query = open('query.sql', 'r').read()
-# Execute a consulta
-c.execute(query)
-table = from_db_cursor(c)
-
-# Transforme o resultado da consulta em um DataFrame
-df = pd.read_sql_query(query, conn)
-
-ras_to_exclude = ['entorno_df']
-
-df['province'] = df['province'].apply(lambda x: clean_names(x))
-
-df = df[~df['province'].isin(ras_to_exclude)]
-df['province'] = df['province'].apply(lambda x: remover_acentos(x.replace(' ', '_')).lower().replace('/', '_') if pd.notnull(x) else None)
-df = df.rename(columns={'province': 'ra'})
-df[['date', 'ra', 'case_cnt', 'death_cnt']].to_csv(os.path.join(data_path, 'dados-gerais.csv'), index=False)
-
-conn.close()
-
-print("Arquivo dados-gerais.csv criado com sucesso!")
\ No newline at end of file
+def clean_provinces(df):
+    df['province'] = df['province'].apply(lambda x: clean_names(x))
+
+    df = df[~df['province'].isin(ras_to_exclude)]
+    df['province'] = df['province'].apply(lambda x: remover_acentos(x.replace(' ', '_')).lower().replace('/', '_') if pd.notnull(x) else None)
+    df = df.rename(columns={'province': 'ra'})
+    return df[['date', 'ra', 'case_cnt', 'death_cnt']]
+
+def create_tables(conn):
+    conn.execute("create table if not exists etl_state (key text primary key, value text)")
+    conn.execute("""create table if not exists daily_aggregates (
+        date text, ra text, case_cnt integer, death_cnt integer, primary key (date, ra))""")
+
+def get_state(conn, key):
+    row = conn.execute("select value from etl_state where key = ?", (key,)).fetchone()
+    return None if row is None else row[0]
+
+def set_state(conn, key, value):
+    conn.execute("insert into etl_state (key, value) values (?, ?) "
+                 "on conflict (key) do update set value = excluded.value", (key, str(value)))
+
+def table_exists(conn, table):
+    return conn.execute("select 1 from sqlite_master where type = 'table' and name = ?", (table,)).fetchone() is not None
+
+def write_csv(df, append=False):
+    # Appending copies the current file first (a byte copy, no parsing) and appends to
+    # the copy. The typed parquet copy (see columnar.py) is written after the CSV.
+    if not append:
+        columnar.write(df, output_file, 'cases')
+        return
+    previous = columnar.read(output_file, 'cases') if columnar.is_fresh(output_file) else pd.read_csv(output_file)
+    with atomic_write(output_file) as tmp_file:
+        shutil.copyfile(output_file, tmp_file)
+        df.to_csv(tmp_file, mode='a', header=False, index=False)
+    columnar.write(pd.concat([previous, df], ignore_index=True), output_file, 'cases', csv=False)
+
+def tail_digest(offset):
+    # Digest of the TAIL_BYTES of dados-abertos.csv before offset
+    start = max(0, offset - TAIL_BYTES)
+    with open(csv_file, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+def set_position(conn, rows_loaded, offset):
+    # How much of dados-abertos.csv is in historical_data: rows and bytes
+    set_state(conn, 'rows_loaded', rows_loaded)
+    set_state(conn, 'csv_offset', offset)
+    set_state(conn, 'csv_tail', tail_digest(offset))
+
+def export(conn, since=None):
+    # Rewrites dados-gerais.csv from the aggregates or, with since, appends the days
+    # after it. The export state stays 'pending' until the file is written, so a run
+    # that fails here is followed by a full rewrite.
+    condition = '' if since is None else "and date > '" + since + "'"
+    write_csv(clean_provinces(pd.read_sql_query(EXPORT_AGGREGATES.format(condition=condition), conn)),
+              append=since is not None)
+    with conn:
+        set_state(conn, 'export', 'done')
+
+def full_refresh(conn):
+    print('Criando banco de dados...')
+    with conn:
+        # Forgotten first, so that a rebuild interrupted below is started over
+        conn.execute("delete from etl_state")
+    rows, offset = create_db.load_data(conn, csv_file)
+    with conn:
+        conn.execute("delete from daily_aggregates")
+        conn.execute(UPSERT_AGGREGATES.format(source=ALL_ROWS))
+        set_position(conn, rows, offset)
+        set_state(conn, 'watermark', conn.execute("select max(date) from daily_aggregates").fetchone()[0])
+        set_state(conn, 'export', 'pending')
+    export(conn)
+    return rows
+
+def incremental_refresh(conn):
+    # Only the bytes appended to dados-abertos.csv since the last run are parsed, and
+    # only the (date, ra) groups they touch are aggregated again
+    rows_loaded = int(get_state(conn, 'rows_loaded'))
+    watermark = get_state(conn, 'watermark')
+    rewrite = get_state(conn, 'export') != 'done'
+
+    # The new rows, their aggregates and the new position are committed together, so
+    # a run that fails halfway leaves no rows behind to be inserted and counted twice
+    with conn:
+        rows, affected, offset = create_db.append_data(conn, csv_file, int(get_state(conn, 'csv_offset')))
+        affected = affected.rename(columns={'dataprimeirosintomas': 'date'}).dropna(subset=['date'])
+        if len(affected) > 0:
+            conn.execute("create temp table if not exists affected (date text, ra text)")
+            conn.execute("delete from affected")
+            conn.executemany("insert into affected (date, ra) values (?, ?)",
+                             affected[['date', 'ra']].itertuples(index=False, name=None))
+            conn.execute(UPSERT_AGGREGATES.format(source=AFFECTED_ROWS))
+            set_state(conn, 'watermark', max(watermark or '', affected['date'].max()))
+            set_state(conn, 'export', 'pending')
+        set_position(conn, rows_loaded + rows, offset)
+
+    if len(affected) == 0 and not rewrite:
+        return rows
+    if not rewrite and watermark is not None and affected['date'].min() > watermark:
+        # Only days after the last export: append them
+        export(conn, since=watermark)
+    else:
+        # Late reports changed days already exported, or the last export failed:
+        # rewrite from the aggregates
+        export(conn)
+    return rows
+
+def refresh():
+    conn = create_db.connect(database_file)
+    try:
+        create_tables(conn)
+        csv_size = os.path.getsize(csv_file)
+        offset = get_state(conn, 'csv_offset')
+        if (not table_exists(conn, create_db.TABLE) or get_state(conn, 'rows_loaded') is None
+                or offset is None or csv_size < int(offset)
+                or get_state(conn, 'csv_tail') != tail_digest(int(offset)) or not os.path.exists(output_file)):
+            # First run, or the CSV was replaced rather than appended to: rebuild everything
+            rows = full_refresh(conn)
+        else:
+            print('Banco de dados já existe')
+            rows = incremental_refresh(conn)
+    finally:
+        conn.close()
+    return rows
+
+if __name__ == '__main__':
+    rows = refresh()
+    print(rows, "linhas novas processadas")
+    print("Arquivo dados-gerais.csv criado com sucesso!")
@@ -2,25 +2,113 @@ import pandas as pd
 import sqlite3
 import warnings
 import os
+from files import data_path
 warnings.filterwarnings("ignore")
 
-current_directory = os.path.dirname(os.path.abspath(__file__))
-data_path = os.path.join(current_directory, 'data')
-
-# Read the data
-def load_data():
-    df = pd.read_csv(os.path.join(data_path, 'dados-abertos.csv'), sep=';')
-    return df
-
-# Get the data
-df = load_data()
-# Clean the data
-df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('(', '').str.replace(')', '')
-# Create the database
-conn = sqlite3.connect(os.path.join(data_path, 'covid_data.db'))
-# Create the table
-df.to_sql('historical_data', conn, if_exists='replace', index=False)
-# Close the connection
-conn.commit()
-conn.close()
+CSV_FILE = os.path.join(data_path, 'dados-abertos.csv')
+DATABASE_FILE = os.path.join(data_path, 'covid_data.db')
+TABLE = 'historical_data'
+CHUNK_SIZE = 100000 # rows read from the CSV and inserted per transaction
+INDEXES = {
+    'idx_historical_data_dataprimeirosintomas_ra': ['dataprimeirosintomas', 'ra'],
+    'idx_historical_data_ra': ['ra'],
+}
 
+def clean_columns(columns):
+    return columns.str.strip().str.lower().str.replace(' ', '_').str.replace('(', '').str.replace(')', '')
+
+def normalize_dates(chunk):
+    # Dates come as dd/mm/yyyy; stored as ISO yyyy-mm-dd so that they sort and
+    # compare as text, with NULL for empty or invalid dates
+    for column in chunk.columns:
+        if column.startswith('data'):
+            dates = pd.to_datetime(chunk[column], format='%d/%m/%Y', errors='coerce')
+            chunk[column] = dates.dt.strftime('%Y-%m-%d').where(dates.notna(), None)
+    return chunk
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def read_chunks(f, chunk_size=CHUNK_SIZE, names=None):
+    # Cleaned chunks of the CSV open in f, from its current position. names are the
+    # CSV's columns, for a position past the header line.
+    for chunk in pd.read_csv(f, sep=';', dtype=str, chunksize=chunk_size,
+                             header='infer' if names is None else None, names=names):
+        chunk.columns = clean_columns(chunk.columns)
+        chunk = normalize_dates(chunk)
+        yield chunk.astype(object).where(chunk.notna(), None)
+
+def insert_statement(table, columns):
+    return ('INSERT INTO ' + quote(table) + ' (' + ', '.join(quote(column) for column in columns) +
+            ') VALUES (' + ', '.join('?' for _ in columns) + ')')
+
+def create_indexes(conn):
+    for name, columns in INDEXES.items():
+        conn.execute('CREATE INDEX IF NOT EXISTS ' + quote(name) + ' ON ' + quote(TABLE) +
+                     ' (' + ', '.join(quote(column) for column in columns) + ')')
+
+def load_data(conn, csv_file=CSV_FILE, chunk_size=CHUNK_SIZE):
+    # Streams the CSV into a new table in chunks, so memory does not grow with the
+    # file, and swaps it with the old table only once every row is in. Returns the
+    # number of rows and the byte offset where reading stopped (the end of the file).
+    new_table = TABLE + '_new'
+    conn.execute('DROP TABLE IF EXISTS ' + quote(new_table))
+    insert = None
+    rows = 0
+    with open(csv_file, 'rb') as f:
+        for chunk in read_chunks(f, chunk_size):
+            if insert is None:
+                conn.execute('CREATE TABLE ' + quote(new_table) + ' (' +
+                             ', '.join(quote(column) + ' TEXT' for column in chunk.columns) + ')')
+                insert = insert_statement(new_table, chunk.columns)
+            with conn:
+                conn.executemany(insert, chunk.itertuples(index=False, name=None))
+            rows += len(chunk)
+        end = f.tell()
+
+    with conn:
+        conn.execute('DROP TABLE IF EXISTS ' + quote(TABLE))
+        conn.execute('ALTER TABLE ' + quote(new_table) + ' RENAME TO ' + quote(TABLE))
+        create_indexes(conn)
+    conn.execute('ANALYZE')
+    return rows, end
+
+def append_data(conn, csv_file=CSV_FILE, offset=0, chunk_size=CHUNK_SIZE):
+    # Inserts the rows of the CSV after the byte offset (the end of what was loaded
+    # before) into the existing table, parsing nothing before it. Nothing is
+    # committed, so the caller can commit the rows together with what depends on
+    # them. Returns how many rows were inserted, the distinct (date, ra) pairs they
+    # touch and the offset where reading stopped.
+    rows = 0
+    touched = []
+    names = pd.read_csv(csv_file, sep=';', nrows=0).columns
+    with open(csv_file, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if offset < end:
+            f.seek(offset)
+            for chunk in read_chunks(f, chunk_size, names):
+                conn.executemany(insert_statement(TABLE, chunk.columns), chunk.itertuples(index=False, name=None))
+                rows += len(chunk)
+                touched.append(chunk[['dataprimeirosintomas', 'ra']].drop_duplicates())
+            end = f.tell()
+    if not touched:
+        return rows, pd.DataFrame(columns=['dataprimeirosintomas', 'ra']), end
+    return rows, pd.concat(touched).drop_duplicates(), end
+
+def connect(database_file=DATABASE_FILE):
+    conn = sqlite3.connect(database_file)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+def create_db(csv_file=CSV_FILE, database_file=DATABASE_FILE):
+    conn = connect(database_file)
+    try:
+        rows, _ = load_data(conn, csv_file)
+        return rows
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    rows = create_db()
+    print(rows, 'linhas carregadas em', DATABASE_FILE)
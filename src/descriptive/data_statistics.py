@@ -2,6 +2,8 @@ import pandas as pd
 import datetime
 import os
 
+from ..transmission_rate import TransmissionRate
+
 current_directory = os.path.dirname(os.path.abspath(__file__))
 parent_directory = os.path.dirname(current_directory)
 data_path = os.path.join(parent_directory, 'data')
@@ -9,6 +11,14 @@ data_path = os.path.join(parent_directory, 'data')
 class Statistics:
     def __init__(self):
         self.dataset = pd.read_csv(os.path.join(data_path, 'dados-abertos.csv'), sep=';')
+        # Parsed once here so that every monthly count below is a single groupby
+        self.died = self.dataset['Óbito'] != 'Não'
+        self.recovered = self.dataset['Óbito'] != 'Sim'
+        self.death_date = pd.to_datetime(self.dataset['Data do Óbito'], format='%d/%m/%Y', errors='coerce')
+        self.first_symptoms_date = pd.to_datetime(self.dataset['dataPrimeirosintomas'], format='%d/%m/%Y',
+                                                  errors='coerce')
+        self.cases_file = os.path.join(data_path, 'dados-gerais.csv')
+        self.transmission_rate = TransmissionRate()
         
     def get_last_nine_months(self):
         month = datetime.datetime.now().month
@@ -22,6 +32,14 @@ class Statistics:
                 month = 12
                 year -= 1
         return last_nine_months
+
+    def count_per_month(self, dates):
+        # Number of dates in each of the last nine months, keyed "month-year"
+        last_nine_months = self.get_last_nine_months()
+        months = pd.PeriodIndex([pd.Period(year=year, month=month, freq='M') for month, year in last_nine_months])
+        counts = dates.dt.to_period('M').value_counts().reindex(months, fill_value=0)
+        return {str(month) + '-' + str(year): int(count)
+                for (month, year), count in zip(last_nine_months, counts.to_numpy())}
     
     def region_pontuation(self):
         bed_availability = 22
@@ -42,26 +60,14 @@ class Statistics:
         return 872
     
     def region_get_recover_cases(self): 
-        return int(self.dataset.loc[self.dataset['Óbito'] != 'Sim'].size)
+        # Same as .size of the selected rows (rows times columns), without copying them
+        return int(self.recovered.sum())*self.dataset.shape[1]
     
     def region_get_death_cases(self):
-        return int(self.dataset.loc[self.dataset['Óbito'] != 'Não'].size)
+        return int(self.died.sum())*self.dataset.shape[1]
     
     def region_get_deaths_per_month(self):
-        deaths = {}
-        last_nine_months = self.get_last_nine_months()
-        death_day = self.dataset.loc[self.dataset['Óbito'] != "Não"]['Data do Óbito']
-        for month_year in last_nine_months:
-            deaths_per_month = 0
-            for date in death_day:
-                splited_data = date.split('/')
-                if int(splited_data[2]) == month_year[1]:
-                    if int(splited_data[1]) == int(month_year[0]):
-                        deaths_per_month+=1
-            key = str(month_year[0]) + '-' + str(month_year[1])
-            deaths[key] = int(deaths_per_month)
-        
-        return deaths
+        return self.count_per_month(self.death_date[self.died])
     
     def region_get_vaccination(self):
         return {'vaccinated': 61, 'not_vaccinated': 39}
@@ -79,24 +85,27 @@ class Statistics:
                 "11-2023": 87, "10-2023": 91, "9-2023": 123, "8-2023": 215, "7-2023": 231}
         
     def region_get_transmition_rate_per_month(self):
-        return {"3-2024": 1.2, "2-2024": 1.3, "1-2024": 1.6, "12-2023": 1.6,
-                "11-2023": 1.8, "10-2023": 1.5, "9-2023": 1.3, "8-2023": 1.4, "7-2023": 0.7}
+        # Mean daily R_t of the whole region, None for months without cases to estimate from
+        stat = os.stat(self.cases_file)
+        version = (stat.st_mtime_ns, stat.st_size)
+        rates = self.transmission_rate.cache.get(version)
+        if rates is None:
+            cases = pd.read_csv(self.cases_file, usecols=['date', 'case_cnt'])
+            cases = cases.rename(columns={'date': 'ds', 'case_cnt': 'y'}).assign(unique_id='DF')
+            cases['ds'] = pd.to_datetime(cases['ds'])
+            rates = self.transmission_rate.estimate(cases, version)
+        monthly = rates.groupby(rates['ds'].dt.to_period('M'))['rt'].mean()
+
+        transmission_rate = {}
+        for month, year in self.get_last_nine_months():
+            rate = monthly.get(pd.Period(year=year, month=month, freq='M'))
+            key = str(month) + '-' + str(year)
+            transmission_rate[key] = None if rate is None or pd.isna(rate) else round(float(rate), 2)
+
+        return transmission_rate
     
     def region_get_contamination_per_month(self):
-        contamination = {}
-        last_nine_months = self.get_last_nine_months()
-        death_day = self.dataset['dataPrimeirosintomas']
-        for month_year in last_nine_months:
-            deaths_per_month = 0
-            for date in death_day:
-                splited_data = date.split('/')
-                if int(splited_data[2]) == month_year[1]:
-                    if int(splited_data[1]) == int(month_year[0]):
-                        deaths_per_month+=1
-            key = str(month_year[0]) + '-' + str(month_year[1])
-            contamination[key] = int(deaths_per_month)
-        
-        return contamination
+        return self.count_per_month(self.first_symptoms_date)
     
     def region_get_mild_cases_per_month(self):
         return {"3-2024": 120, "2-2024": 231, "1-2024": 162, "12-2023": 114,
@@ -0,0 +1,19 @@
+import os
+import contextlib
+
+# Datasets, fitted models and caches live under src/data
+data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+@contextlib.contextmanager
+def atomic_write(file):
+    # Yields a temporary name next to file to write to, and renames it over file when
+    # the block succeeds, so readers never see half a file and a crash never leaves
+    # one. If the block fails, the temporary file is removed and file is untouched.
+    tmp_file = file + '.tmp'
+    try:
+        yield tmp_file
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, file)
@@ -0,0 +1,78 @@
+import os
+import threading
+import pandas as pd
+
+from . import columnar
+from .files import data_path
+
+class ForecastStore:
+    # forecast.csv kept in memory, sorted by date overall and within each RA, so
+    # that a date range is two binary searches. The file is parsed again only when
+    # its modification time changes, e.g. after a job process wrote a new forecast.
+    COLUMNS = ['unique_id', 'ds', 'y_hat']
+
+    def __init__(self, file=os.path.join(data_path, 'pred_results', 'forecast.csv')):
+        self.file = file
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.index(pd.DataFrame(columns=self.COLUMNS))
+
+    def index(self, forecast):
+        forecast = forecast.assign(ds=pd.to_datetime(forecast['ds']))
+        self.frame = forecast.sort_values(['ds', 'unique_id'], kind='stable').reset_index(drop=True)
+        self.dates = self.frame['ds'].values
+        self.by_ra = {}
+        for ra, rows in self.frame.groupby('unique_id', sort=False):
+            rows = rows.reset_index(drop=True)
+            self.by_ra[ra] = (rows, rows['ds'].values)
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            if mtime is None:
+                self.index(pd.DataFrame(columns=self.COLUMNS))
+            elif columnar.is_fresh(self.file):
+                forecast = columnar.read(self.file, 'forecast')
+                self.index(forecast.assign(unique_id=forecast['unique_id'].astype(str)))
+            else:
+                self.index(pd.read_csv(self.file))
+            self.mtime = mtime
+
+    def write(self, forecast):
+        # CSV and parquet copies, see columnar.write
+        forecast = forecast[self.COLUMNS]
+        columnar.write(forecast, self.file, 'forecast')
+        with self.lock:
+            self.index(forecast)
+            self.mtime = os.stat(self.file).st_mtime_ns
+
+    def get(self):
+        self.refresh()
+        return self.frame
+
+    def version(self):
+        # Modification time of the file the store was loaded from, None without a forecast
+        self.refresh()
+        return self.mtime
+
+    def max_date(self):
+        self.refresh()
+        return self.frame['ds'].max()
+
+    def range(self, start_date, end_date, ra=None):
+        # Rows with start_date <= ds <= end_date, of a single RA when ra is given
+        self.refresh()
+        if ra is None:
+            rows, dates = self.frame, self.dates
+        elif ra in self.by_ra:
+            rows, dates = self.by_ra[ra]
+        else:
+            return self.frame.iloc[0:0]
+        start = dates.searchsorted(pd.Timestamp(start_date).to_datetime64(), side='left')
+        end = dates.searchsorted(pd.Timestamp(end_date).to_datetime64(), side='right')
+        return rows.iloc[start:end]
@@ -0,0 +1,178 @@
+import os
+import time
+import uuid
+import queue
+import atexit
+import signal
+import threading
+
+from .processes import context
+
+# Jobs are started by the fork server rather than forked from the web process: a
+# fork of this multithreaded process inherits locks held by other request threads
+# (the spreadsheet snapshot, the caches, the forecast store) and may hang on them.
+# They are not daemonic because jobs may start process pools.
+
+def run_job(function, params, conn):
+  # A process group of its own, so that cancelling the job also stops the processes
+  # it started (tuning workers, backtest and scenario pools)
+  os.setsid()
+  try:
+    conn.send(('done', function(**params)))
+  except Exception as err:
+    conn.send(('failed', repr(err)))
+  finally:
+    conn.close()
+
+def stop(process):
+  try:
+    os.killpg(process.pid, signal.SIGTERM)
+  except ProcessLookupError: # not in its own group yet, so it has not started anything
+    process.terminate()
+
+class Job:
+  def __init__(self, kind, params):
+    self.id = uuid.uuid4().hex
+    self.kind = kind
+    self.params = params
+    self.status = 'queued' # queued, running, done, failed or cancelled
+    self.result = None
+    self.error = None
+    self.submitted_at = time.time()
+    self.started_at = None
+    self.finished_at = None
+    self.process = None
+
+  def finished(self):
+    return self.status in ('done', 'failed', 'cancelled')
+
+  def to_dict(self):
+    return {
+      'id': self.id,
+      'kind': self.kind,
+      'status': self.status,
+      'error': self.error,
+      'submitted_at': self.submitted_at,
+      'started_at': self.started_at,
+      'finished_at': self.finished_at
+    }
+
+class JobQueue:
+  # Long-running work (Optuna tuning, MIP solves) submitted from request threads.
+  # max_workers threads take jobs in submission order and run each one in its own
+  # process, so at most max_workers jobs run at once and a cancelled job can be
+  # terminated. Finished jobs are dropped retention seconds after they finish.
+  def __init__(self, functions, max_workers = 2, retention = 60*60):
+    self.functions = functions
+    self.max_workers = max_workers
+    self.retention = retention
+    self.jobs = {}
+    self.pending = queue.Queue()
+    self.lock = threading.Lock()
+    self.workers = []
+    for _ in range(max_workers):
+      worker = threading.Thread(target=self.work, daemon=True)
+      worker.start()
+      self.workers.append(worker)
+    atexit.register(self.shutdown)
+
+  def submit(self, kind, params = None):
+    if kind not in self.functions:
+      raise ValueError("unknown job kind: " + str(kind))
+    job = Job(kind, params or {})
+    with self.lock:
+      self.expire()
+      self.jobs[job.id] = job
+    self.pending.put(job)
+    return job
+
+  def get(self, job_id):
+    with self.lock:
+      self.expire()
+      return self.jobs.get(job_id)
+
+  def cancel(self, job_id):
+    with self.lock:
+      job = self.jobs.get(job_id)
+      if job is None or job.finished():
+        return job
+      if job.process is not None:
+        stop(job.process)
+      job.status = 'cancelled'
+      job.finished_at = time.time()
+      return job
+
+  def expire(self):
+    # Called with self.lock held
+    now = time.time()
+    for job_id in [job_id for job_id, job in self.jobs.items()
+      if job.finished() and now - job.finished_at > self.retention]:
+      del self.jobs[job_id]
+
+  def work(self):
+    while True:
+      job = self.pending.get()
+      if job is None:
+        return
+      try:
+        self.run(job)
+      except Exception as err:
+        # The job could not be started (the fork server failed, a param cannot be
+        # pickled) or its answer could not be read: it fails, this worker goes on
+        with self.lock:
+          process, job.process = job.process, None
+          if job.status in ('queued', 'running'):
+            job.status = 'failed'
+            job.error = repr(err)
+            job.finished_at = time.time()
+        if process is not None:
+          if process.is_alive():
+            stop(process)
+          process.join()
+
+  def run(self, job):
+    with self.lock:
+      if job.status != 'queued': # cancelled while waiting
+        return
+      receiver, sender = context.Pipe(duplex=False)
+      try:
+        job.process = context.Process(target=run_job,
+          args=(self.functions[job.kind], job.params, sender))
+        job.process.start()
+      except Exception:
+        job.process = None
+        receiver.close()
+        sender.close()
+        raise
+      job.status = 'running'
+      job.started_at = time.time()
+    sender.close()
+
+    try:
+      status, value = receiver.recv()
+    except EOFError: # terminated by cancel() or died without answering
+      status, value = 'failed', None
+    finally:
+      receiver.close()
+    job.process.join()
+    if value is None and status == 'failed':
+      value = 'worker process exited with code ' + str(job.process.exitcode)
+
+    with self.lock:
+      job.process = None
+      if job.status == 'cancelled':
+        return
+      job.status = status
+      if status == 'done':
+        job.result = value
+      else:
+        job.error = value
+      job.finished_at = time.time()
+
+  def shutdown(self):
+    with self.lock:
+      for job in self.jobs.values():
+        if job.process is not None:
+          stop(job.process)
+    for _ in self.workers:
+      self.pending.put(None)
@@ -1,13 +1,58 @@
 import pyomo.environ as pyo
+import numpy as np
+import highspy
 import math
-from os import path
+import time
+import json
+import copy
+import hashlib
+import threading
+from os import path, cpu_count, stat
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+
+from jinja2 import Environment, FileSystemLoader
 
 from .read_data import ReadData
-from .predictive import Predictive
+from .cache import SolutionCache
+from .predictive import get_default_predictive
+from .processes import context
+
+REPORT_IMAGES = {'coins': 'coins.png', 'hospital': 'hospital.png', 'hospital_bed': 'hospital_bed.png',
+  'sus': 'sus.png', 'years': '20_years.png', 'footer': 'footer.png'}
+
+def format_currency(value):
+  # 1234567.5 -> 1.234.567,5
+  value_str = str(f'{value:,}').replace('.', ',')
+  return value_str.replace(',', '.', value_str.count(',') - 1)
+
+_report_template = None
+
+def get_report_template():
+  # Compiled once per process
+  global _report_template
+  if _report_template is None:
+    environment = Environment(loader=FileSystemLoader(path.join(path.dirname(path.abspath(__file__)),
+      'templates')), autoescape=True)
+    environment.filters['currency'] = format_currency
+    _report_template = environment.get_template('prescriptive_report.html')
+  return _report_template
+
+def relative_gap(upper_bound, lower_bound):
+  # Same definition as HiGHS' mip_gap: |primal - dual| / |primal|
+  try:
+    return abs(upper_bound - lower_bound)/max(abs(upper_bound), 1e-10)
+  except TypeError:
+    return None
 
 class Data:
-  def __init__(self, demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None):
-    self.data_reader = ReadData(equipment_rates, staff_rates, consumable_rates)
+  def __init__(self, demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None,
+    data_reader = None):
+    if data_reader is None:
+      data_reader = ReadData(equipment_rates, staff_rates, consumable_rates)
+    self.data_reader = data_reader
 
     self.F = list(range(len(self.data_reader.get_hospital_ids()))) # F: set of facilities
     self.dict_hospitals = {id: iter for iter, id in enumerate(self.data_reader.get_hospital_ids())}
@@ -31,7 +76,7 @@ class Data:
     if demand:
       self.d = demand # d: demand of ICU beds
     else:
-      self.d = math.ceil(Predictive().contamination(1, True)[0]['cases']*11.6/10)
+      self.d = math.ceil(get_default_predictive().contamination(1, True)[0]['cases']*11.6/10)
         # "[...] permanência média na UTI de 11,6 dias." Source: https://www.cnnbrasil.com.br/saude/internacoes-por-covid-19-duram-em-media-22-dias-aponta-pesquisa/
         # https://noticias.uol.com.br/saude/ultimas-noticias/redacao/2020/03/17/somente-1-em-cada-10-casos-do-novo-coronavirus-estao-hospitalizados.htm
     
@@ -42,6 +87,8 @@ class Data:
       else:
         self.c.append(self.data_reader.get_hospital_construction_cost(id))
     
+    self.coords = [self.data_reader.get_hospital_coords(id) for id in self.data_reader.get_hospital_ids()] # coords: location of each facility
+
     self.l = [self.data_reader.get_hospital_lb_beds(id) for id in self.data_reader.get_hospital_ids()] # l: lower bound of ICU beds in each facility, if built
     
     self.u = [self.data_reader.get_hospital_ub_beds(id) for id in self.data_reader.get_hospital_ids()] # u: upper bound of ICU beds in each facility
@@ -88,6 +135,27 @@ class Data:
           costs_for_req_j.append([int(n) for n in file_object.readline().split()])
         self.t.append(costs_for_req_j)
       
+  def scenario(self, demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None):
+    # Copy of this data with another demand and other necessary rates, without
+    # reading the spreadsheet again
+    scenario = copy.copy(self)
+    if demand:
+      scenario.d = demand
+    scenario.n = [self.data_reader.get_equipment_necessary_rate(id, equipment_rates or {})
+      for id in self.data_reader.get_equipment_ids()]
+    scenario.n += [self.data_reader.get_staff_necessary_rate(id, staff_rates or {})
+      for id in self.data_reader.get_staff_ids()]
+    scenario.n += [self.data_reader.get_consumable_necessary_rate(id, consumable_rates or {})
+      for id in self.data_reader.get_consumable_ids()]
+    return scenario
+
+  def structure_key(self):
+    # Digest of everything the model is built from except d and n, which are
+    # mutable parameters of a persistent model
+    structure = [self.F, self.K, self.R, self.U, self.c, self.l, self.u, self.p, self.r, self.a,
+      self.m, self.t, self.coords]
+    return hashlib.sha256(json.dumps(structure).encode('utf-8')).hexdigest()
+
   def print_data(self):
     print('F:', self.F)
     print('K:', self.K)
@@ -104,48 +172,115 @@ class Data:
     print('m:', self.m)
     print('t:', self.t)
 
+def transfer_arcs(data, complete = False, k_nearest = None, max_transfer_cost = None):
+  # Arcs (j, i, l) of the transfer network: facility i may send requirement j to l.
+  # Transfers are bounded by a[i][j], so arcs leaving facilities without stock of j
+  # are dropped without changing the optimum. k_nearest and max_transfer_cost
+  # restrict the network further and may change it; complete builds every arc.
+  if k_nearest is not None:
+    neighbours = []
+    for i in data.F:
+      others = sorted((l for l in data.F if l != i),
+        key=lambda l: math.dist(data.coords[i], data.coords[l]))
+      neighbours.append(set(others[:k_nearest]))
+
+  arcs = []
+  for j in data.R + data.U:
+    for i in data.F:
+      if not complete and data.a[i][j] <= 0:
+        continue
+      for l in data.F:
+        if l == i:
+          continue
+        if not complete:
+          if k_nearest is not None and l not in neighbours[i]:
+            continue
+          if max_transfer_cost is not None and data.t[j][i][l] > max_transfer_cost:
+            continue
+        arcs.append((j, i, l))
+  return arcs
+
 class Model:
-  def __init__(self, data):
+  def __init__(self, data, transfer_graph = None):
     # Data
     self.data = data
+    # transfer_graph: keyword arguments of transfer_arcs
+    self.arcs = transfer_arcs(self.data, **(transfer_graph or {}))
+
+    self.opt = None
+
+    start = time.perf_counter()
+    self.build()
+    self.build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    self.solve()
+    self.solve_time = time.perf_counter() - start
+
+  def update(self, data):
+    # Re-solves for a new demand and new necessary rates, keeping the rest of the
+    # model (and the solver instance) from the previous solve
+    self.data = data
+    self.model.d.set_value(self.data.d)
+    for j in self.model.R + self.model.U:
+      self.model.n[j].set_value(self.data.n[j])
+    self.build_time = 0
+
+    start = time.perf_counter()
+    self.solve()
+    self.solve_time = time.perf_counter() - start
+
+  def build(self):
     self.model = pyo.ConcreteModel()
     self.model.F = self.data.F
     self.model.R = self.data.R
     self.model.U = self.data.U
     self.model.K = self.data.K
 
+    # Mutable parameters, updated in place between solves
+    self.model.d = pyo.Param(mutable=True, initialize=self.data.d)
+    self.model.n = pyo.Param(self.model.R + self.model.U, mutable=True,
+      initialize={j: self.data.n[j] for j in self.model.R + self.model.U})
+
     # Variables
     self.model.x = pyo.Var(self.model.F, within=pyo.NonNegativeIntegers) # x: number of ICU beds in each facility
     self.model.y = pyo.Var(self.model.F, within=pyo.Binary) # y: whether each facility is built or not
     self.model.z = pyo.Var(self.model.F, (self.model.R + self.model.U), within=pyo.NonNegativeIntegers) # z: number of each requirement acquired by each facility
     self.model.w = pyo.Var(self.model.F, self.model.R, within=pyo.NonNegativeIntegers) # w: number of each requirement repaired in each facility
-    self.model.v = pyo.Var((self.model.R + self.model.U), self.model.F, self.model.F,
+    self.model.A = pyo.Set(initialize=self.arcs, dimen=3) # A: arcs of the transfer network
+    self.model.v = pyo.Var(self.model.A,
       within=pyo.NonNegativeIntegers) # v: number of each requirement transferred from each facility to each facility
+
+    sent_to = {} # sent_to[j, i]: facilities that can receive requirement j from facility i
+    received_from = {} # received_from[j, i]: facilities that can send requirement j to facility i
+    for j, i, l in self.arcs:
+      sent_to.setdefault((j, i), []).append(l)
+      received_from.setdefault((j, l), []).append(i)
     
     # Objective function
     self.model.objective = pyo.Objective(expr=sum(self.data.c[i]*self.model.y[i] +
       sum(self.data.p[j]*self.model.z[i, j] + sum(self.data.t[j][i][l]*self.model.v[j, i, l]
-      for l in self.model.F if l != i) for j in (self.model.R + self.model.U)) +
+      for l in sent_to.get((j, i), [])) for j in (self.model.R + self.model.U)) +
       sum(self.data.m[i][j]*self.model.w[i, j] for j in self.model.R) for i in self.model.F),
       sense=pyo.minimize)
     
     # Constraints
     self.model.demand_constraint = pyo.Constraint(expr=sum(self.model.x[i] for i in self.model.F) >=
-      self.data.d)
+      self.model.d)
     
     self.model.repairable_req_constraint = pyo.ConstraintList()
     for i in self.model.F:
       for j in self.model.R:
         self.model.repairable_req_constraint.add(self.data.a[i][j] + self.model.z[i, j] +
-          self.model.w[i, j] + sum(self.model.v[j, l, i] - self.model.v[j, i, l] for l in self.model.F
-          if l != i) >= self.data.n[j]*self.model.x[i])
+          self.model.w[i, j] + sum(self.model.v[j, l, i] for l in received_from.get((j, i), [])) -
+          sum(self.model.v[j, i, l] for l in sent_to.get((j, i), [])) >= self.model.n[j]*self.model.x[i])
     
     self.model.unrepairable_req_constraint = pyo.ConstraintList()
     for i in self.model.F:
       for j in self.model.U:
         self.model.unrepairable_req_constraint.add(self.data.a[i][j] + self.model.z[i, j] +
-          sum(self.model.v[j, l, i] - self.model.v[j, i, l] for l in self.model.F if l != i) >=
-          self.data.n[j]*self.model.x[i])
+          sum(self.model.v[j, l, i] for l in received_from.get((j, i), [])) -
+          sum(self.model.v[j, i, l] for l in sent_to.get((j, i), [])) >= self.model.n[j]*self.model.x[i])
     
     self.model.repair_constraint = pyo.ConstraintList()
     for i in self.model.F:
@@ -153,11 +288,8 @@ class Model:
         self.model.repair_constraint.add(self.model.w[i, j] <= self.data.m[i][j])
     
     self.model.transfer_constraint = pyo.ConstraintList()
-    for j in self.model.R + self.model.U:
-      for i in self.model.F:
-        for l in self.model.F:
-          if l != i:
-            self.model.transfer_constraint.add(self.model.v[j, i, l] <= self.data.a[i][j])
+    for j, i, l in self.arcs:
+      self.model.transfer_constraint.add(self.model.v[j, i, l] <= self.data.a[i][j])
     
     self.model.bed_limit_constraint = pyo.ConstraintList()
     for i in self.model.F:
@@ -173,10 +305,55 @@ class Model:
       self.model.y_dependent_constraint.add(self.model.x[i] / self.data.u[i] <= self.model.y[i])
       self.model.y_dependent_constraint.add(self.model.y[i] <= self.model.x[i])
     
+  def solve(self):
     # self.model.write('model.lp', io_options={'symbolic_solver_labels': True})
-    opt = pyo.SolverFactory('appsi_highs')
-    self.results = opt.solve(self.model, tee=True)
+    # The APPSI solver is persistent: on later solves it only receives the changed
+    # parameters, and the previous optimal solution is passed as a MIP start
+    warm_start = self.opt is not None
+    if self.opt is None:
+      self.opt = pyo.SolverFactory('appsi_highs')
+    self.results = self.opt.solve(self.model, tee=True, warmstart=warm_start)
+    self.status = str(self.results.solver.termination_condition)
+    self.gap = relative_gap(self.results.problem.upper_bound, self.results.problem.lower_bound)
     
+  def extract_solution(self):
+    # Reads the solver values once: x and y of every facility plus the nonzero
+    # acquisitions, repairs and transfers, indexed by facility
+    def value(var):
+      return int(round(pyo.value(var)))
+
+    facilities = [{'facility': i, 'x': value(self.model.x[i]), 'y': value(self.model.y[i]),
+      'acquire': {}, 'repair': {}, 'send': [], 'receive': []} for i in self.model.F]
+    for i in self.model.F:
+      for j in self.model.R + self.model.U:
+        if value(self.model.z[i, j]) > 0:
+          facilities[i]['acquire'][j] = value(self.model.z[i, j])
+      for j in self.model.R:
+        if value(self.model.w[i, j]) > 0:
+          facilities[i]['repair'][j] = value(self.model.w[i, j])
+    for j, i, l in self.arcs:
+      quantity = value(self.model.v[j, i, l])
+      if quantity > 0:
+        facilities[i]['send'].append({'requirement': j, 'facility': l, 'quantity': quantity})
+        facilities[l]['receive'].append({'requirement': j, 'facility': i, 'quantity': quantity})
+    return facilities
+
+  def summary(self, facilities = None):
+    if facilities is None:
+      facilities = self.extract_solution()
+    beneficiaries = [facility for facility in facilities if facility['y'] > 0]
+    return {
+      'cost': pyo.value(self.model.objective),
+      'beds_added': sum(self.added_beds(facility['facility'], facility['x'])
+        for facility in beneficiaries),
+      'hospitals_benefited': len(beneficiaries),
+      'hospitals_opened': len([facility for facility in beneficiaries
+        if facility['facility'] not in self.model.K]),
+      'status': self.status,
+      'build_time': self.build_time,
+      'solve_time': self.solve_time
+    }
+
   def print_solution(self):
     for i in self.model.F:
       if pyo.value(self.model.y[i]) > 0:
@@ -207,7 +384,7 @@ class Model:
         printedTransfer = False
         for j in self.model.R + self.model.U:
           for l in self.model.F:
-            if l != i:
+            if (j, i, l) in self.model.v:
               if pyo.value(self.model.v[j, i, l]) > 0:
                 if not printedTransfer:
                   print('\tTransfer:')
@@ -218,7 +395,7 @@ class Model:
         printedReceive = False
         for j in self.model.R + self.model.U:
           for l in self.model.F:
-            if l != i:
+            if (j, l, i) in self.model.v:
               if pyo.value(self.model.v[j, l, i]) > 0:
                 if not printedReceive:
                   print('\tReceive:')
@@ -226,335 +403,381 @@ class Model:
                 print('\t\t\t', int(pyo.value(self.model.v[j, l, i])), 'units of requirement', j,
                   'from Hospital', l)
   
-  def to_html(self):
+  def added_beds(self, i, beds):
+    cur_beds = min([self.data.a[i][j]/self.data.n[j] for j in self.model.R + self.model.U])
+    return int(beds - cur_beds)
 
-    budget = pyo.value(self.model.objective)
-    num_hospitals = len([i for i in self.model.F if pyo.value(self.model.y[i]) > 0])
-    added_beds = sum([int(pyo.value(self.model.x[i]) - min([self.data.a[i][j]/self.data.n[j]
-      for j in self.model.R + self.model.U])) for i in self.model.F if pyo.value(self.model.y[i]) > 0])
-    
-    html_content = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-<meta name="viewport" content="width=device-width, initial-scale=1.0">
-<title>Administra&ccedil;&atilde;o de leitos</title>
-<style>
-body {
-  font-family: 'Helvetica', sans-serif;
-  color: #707070;
-  background-color: #f2f2f2;
-  margin: 0;
-  padding: 0;
-}
-
-.header {
-  background-color: #16497F;
-  color: #fff;
-  width: 100%;
-  padding: 20px;
-  text-align: center;
-  box-shadow: 0 2px 4px rgba(0, 0, 0, 0.3);
-}
-
-.title {
-  font-size: 22px;
-  font-weight: bold;
-  text-align: center;
-}
-
-.subtitle {
-  margin: 30px 20px 0px 20px;
-  font-size: 20px;
-  font-weight: bold;
-  color: #505050;
-}
-
-.hospital-container {
-  display: flex;
-  flex-wrap: wrap;
-  justify-content: flex-start;
-  margin: 20px;
-}
-
-.hospital-box {
-  width: calc(28%);
-  margin: 10px;
-  padding: 10px;
-  border-radius: 10px;
-  box-shadow: 0 0 10px rgba(0,0,0,0.3);
-  background-color: #ffffff;
-}
-
-.clear-box {
-  padding: 5px;
-}
-
-.content {
-  font-size: 14px;
-  font-weight: normal;
-}
-
-.image-box {
-  width: calc(20%);
-  margin: 10px;
-  padding: 10px;
-  border-radius: 10px;
-  box-shadow: 0 0 10px rgba(0,0,0,0.3);
-  background-color: #16497F; /* Blue color */
-  color: #fff;
-  text-align: center;
-}
-
-.image-box img {
-  height: 70px;
-  display: block;
-  margin: 0 auto 10px; /* Center the image */
-}
-
-.image-box p {
-  margin: 0; /* Remove default margin */
-}
-
-.footer-box {
-  width: 100%;
-  padding: 10px;
-  text-align: center;
-}
-
-.footer-box img {
-  margin: 0px calc(3%);
-  height: 60px;
-}
-
-</style>
-</head>
-<body>
-<div class="header title">
-  Prescri&ccedil;&atilde;o de administra&ccedil;&atilde;o de leitos de UTI
-</div>
-<div class="subtitle">
-  <p>Informa&ccedil;&otilde;es gerais</p>
-</div>
-<div class="hospital-container">
-  <div class="image-box">
-    <img src=""" + '"' + path.abspath(path.join('figures','coins.png')) + '"' + """alt="Stack of coins">
-    <div class="content">Or&ccedil;amento previsto</div>
-    <div class="content"> R$ """
-    budget_str = str(f'{budget:,}').replace('.', ',')
-    html_content += budget_str.replace(',', '.', budget_str.count(',') - 1) + """ </div>
-    </div>
-    <div class="image-box">
-      <img src=""" + '"' + path.abspath(path.join('figures','hospital.png')) + '"' + """alt="Hospital">
-      <div class="content">Hospitais beneficiados</div> 
-      <div class="content"> {} </div>
-    </div>""".format(num_hospitals)
-    html_content += """
-    <div class="image-box">
-      <img src=""" + '"' + path.abspath(path.join('figures','hospital_bed.png')) + '"'
-    html_content += """ alt="Hospital beds">
-      <div class="content">Leitos adicionados</div>
-      <div class="content"> {} </div>
-    </div>
-</div>
-<div class="subtitle">
-  <p>A&ccedil;&otilde;es prescritas</p>
-</div>
-<div class="hospital-container">""".format(added_beds)
-
-    # Add section for hospitals information
-    for i in self.model.F:
-      if pyo.value(self.model.y[i]) > 0:
-        html_content += """
-<div class="hospital-box">
-  <div class="clear-box">
-    <strong> {} </strong>""".format(self.data.data_reader.get_hospital_name(
-      self.data.dict_hospitals[i]
-    ))
+  def hospital_name(self, i):
+    return self.data.data_reader.get_hospital_name(self.data.dict_hospitals[i])
 
-        if i not in self.model.K:
-          construction_cost_str = str(f'{self.data.c[i]:,}').replace('.', ',')
-          html_content += """
-    <div class="clear-box content">
-        <strong> Construção: </strong> R$ {}
-    </div>""".format(construction_cost_str.replace(',', '.', construction_cost_str.count(',') - 1))
-
-        cur_beds = min([self.data.a[i][j] / self.data.n[j] for j in self.model.R + self.model.U])
-        html_content += """
-    <div class="clear-box content">
-      <strong> Leitos de UTI totais: </strong> {}
-    </div>
-    <div class="clear-box content">
-      <strong> Leitos de UTI adicionados: </strong> {}
-    </div>""".format(int(pyo.value(self.model.x[i])), int(pyo.value(self.model.x[i]) - cur_beds))
+  def requirement_label(self, j, quantity, staff_preposition = 'para o'):
+    if j in self.data.dict_equipments.keys():
+      return (('unidades' if quantity > 1 else 'unidade') + ' de ' +
+        self.data.data_reader.get_equipment_name(self.data.dict_equipments[j]))
+    if j in self.data.dict_staff.keys():
+      return (('profissionais' if quantity > 1 else 'profissional') + ' ' + staff_preposition +
+        ' time ' + self.data.data_reader.get_staff_team(self.data.dict_staff[j]))
+    if j in self.data.dict_consumables.keys():
+      return (('unidades' if quantity > 1 else 'unidade') + ' de ' +
+        self.data.data_reader.get_consumable_name(self.data.dict_consumables[j]))
+    return ''
 
-        printedAcquire = False
-        for j in self.model.R + self.model.U:
-          if pyo.value(self.model.z[i, j]) > 0:
-            if not printedAcquire:
-              html_content += """
-    <div class="clear-box content">
-      <strong> Adquirir: </strong>"""
-              printedAcquire = True
-            req_name_str = ""
-            if j in self.data.dict_equipments.keys():
-              if pyo.value(self.model.z[i, j]) > 1:
-                req_name_str = "unidades"
-              else:
-                req_name_str = "unidade"
-              req_name_str += " de " + self.data.data_reader.get_equipment_name(
-                self.data.dict_equipments[j])
-            elif j in self.data.dict_staff.keys():
-              if pyo.value(self.model.z[i, j]) > 1:
-                req_name_str = "profissionais"
-              else:
-                req_name_str = "profissional"
-              req_name_str += " para o time " + self.data.data_reader.get_staff_team(
-                self.data.dict_staff[j])
-            elif j in self.data.dict_consumables.keys():
-              if pyo.value(self.model.z[i, j]) > 1:
-                req_name_str = "unidades"
-              else:
-                req_name_str = "unidade"
-              req_name_str += " de " + self.data.data_reader.get_consumable_name(
-                self.data.dict_consumables[j])
-            html_content += """
-    <div class="clear-box content">
-      {} {}
-    </div>""".format(int(pyo.value(self.model.z[i, j])), req_name_str)
-        if printedAcquire:
-          html_content += """
-</div>"""
+  def report(self, facilities = None):
+    # Everything the HTML report shows, computed once from the extracted solution
+    if facilities is None:
+      facilities = self.extract_solution()
+    hospitals = []
+    for facility in facilities:
+      if facility['y'] <= 0:
+        continue
+      i = facility['facility']
+      hospitals.append({
+        'name': self.hospital_name(i),
+        'construction_cost': self.data.c[i] if i not in self.model.K else None,
+        'total_beds': facility['x'],
+        'added_beds': self.added_beds(i, facility['x']),
+        'acquire': [(quantity, self.requirement_label(j, quantity))
+          for j, quantity in facility['acquire'].items()],
+        'repair': [(quantity, self.requirement_label(j, quantity))
+          for j, quantity in facility['repair'].items()],
+        'send': [(transfer['quantity'], self.requirement_label(transfer['requirement'],
+          transfer['quantity'], 'do'), self.hospital_name(transfer['facility']))
+          for transfer in facility['send']],
+        'receive': [(transfer['quantity'], self.requirement_label(transfer['requirement'],
+          transfer['quantity'], 'do'), self.hospital_name(transfer['facility']))
+          for transfer in facility['receive']]
+      })
+    return {
+      'budget': pyo.value(self.model.objective),
+      'added_beds': sum(hospital['added_beds'] for hospital in hospitals),
+      'hospitals': hospitals,
+      'images': {name: path.abspath(path.join('figures', file)) for name, file in REPORT_IMAGES.items()}
+    }
 
-        printedRepair = False
-        for j in self.model.R:
-          if pyo.value(self.model.w[i, j]) > 0:
-            if not printedRepair:
-              html_content += """
-<div class="clear-box content">
-    <strong> Reparar: </strong>"""
-              printedRepair = True
-            req_name_str = ""
-            if j in self.data.dict_equipments.keys():
-              if pyo.value(self.model.w[i, j]) > 1:
-                req_name_str = "unidades"
-              else:
-                req_name_str = "unidade"
-              req_name_str += " de " + self.data.data_reader.get_equipment_name(
-                self.data.dict_equipments[j])
-            html_content += """
-<div class="clear-box content">
-    {} {}
-</div>""".format(int(pyo.value(self.model.w[i, j])), req_name_str)
-        if printedRepair:
-          html_content += """
-</div>"""
+  def render_html(self, facilities = None):
+    # Generator over chunks of the HTML report, rendered in a single pass
+    return get_report_template().generate(**self.report(facilities))
 
-        printedTransfer = False
-        for j in self.model.R + self.model.U:
-          for l in self.model.F:
-            if l != i:
-              if pyo.value(self.model.v[j, i, l]) > 0:
-                if not printedTransfer:
-                  html_content += """
-<div class="clear-box content">
-    <strong> Transferir: </strong>"""
-                  printedTransfer = True
-                if j in self.data.dict_equipments.keys():
-                  if pyo.value(self.model.v[j, i, l]) > 1:
-                    req_name_str = "unidades"
-                  else:
-                    req_name_str = "unidade"
-                  req_name_str += " de " + self.data.data_reader.get_equipment_name(
-                    self.data.dict_equipments[j])
-                elif j in self.data.dict_staff.keys():
-                  if pyo.value(self.model.v[j, i, l]) > 1:
-                    req_name_str = "profissionais"
-                  else:
-                    req_name_str = "profissional"
-                  req_name_str += " do time " + self.data.data_reader.get_staff_team(
-                    self.data.dict_staff[j])
-                elif j in self.data.dict_consumables.keys():
-                  if pyo.value(self.model.v[j, i, l]) > 1:
-                    req_name_str = "unidades"
-                  else:
-                    req_name_str = "unidade"
-                  req_name_str += " de " + self.data.data_reader.get_consumable_name(
-                    self.data.dict_consumables[j])
-                html_content += """
-<div class="clear-box content">
-    {} {} ao {}
-</div>""".format(int(pyo.value(self.model.v[j, i, l])), req_name_str,
-  self.data.data_reader.get_hospital_name(self.data.dict_hospitals[l]))
-        if printedTransfer:
-          html_content += """
-</div>"""
+  def requirement_ref(self, j):
+    if j in self.data.dict_equipments.keys():
+      return {'requirement': j, 'type': 'equipment', 'id': self.data.dict_equipments[j]}
+    if j in self.data.dict_staff.keys():
+      return {'requirement': j, 'type': 'staff', 'id': self.data.dict_staff[j]}
+    return {'requirement': j, 'type': 'consumable', 'id': self.data.dict_consumables.get(j)}
 
-        printedReceive = False
-        for j in self.model.R + self.model.U:
-          for l in self.model.F:
-            if l != i:
-              if pyo.value(self.model.v[j, l, i]) > 0:
-                if not printedReceive:
-                  html_content += """
-<div class="clear-box content">
-    <strong> Receber: </strong>"""
-                  printedReceive = True
-                if j in self.data.dict_equipments.keys():
-                  if pyo.value(self.model.v[j, l, i]) > 1:
-                    req_name_str = "unidades"
-                  else:
-                    req_name_str = "unidade"
-                  req_name_str += " de " + self.data.data_reader.get_equipment_name(
-                    self.data.dict_equipments[j])
-                elif j in self.data.dict_staff.keys():
-                  if pyo.value(self.model.v[j, l, i]) > 1:
-                    req_name_str = "profissionais"
-                  else:
-                    req_name_str = "profissional"
-                  req_name_str += " do time " + self.data.data_reader.get_staff_team(
-                    self.data.dict_staff[j])
-                elif j in self.data.dict_consumables.keys():
-                  if pyo.value(self.model.v[j, l, i]) > 1:
-                    req_name_str = "unidades"
-                  else:
-                    req_name_str = "unidade"
-                  req_name_str += " de " + self.data.data_reader.get_consumable_name(
-                    self.data.dict_consumables[j])
-                html_content += """
-<div class="clear-box content">
-    {} {} do {}
-</div>""".format(int(pyo.value(self.model.v[j, l, i])), req_name_str,
-  self.data.data_reader.get_hospital_name(self.data.dict_hospitals[l]))
-        if printedReceive:
-          html_content += """
-</div>"""
-
-        html_content += """
-</div>
-</div>"""
-
-    html_content += """
-</div>
-</body>
-<hr color=#e9e9e9>
-<footer>
-<div class="footer-box">
-    <img src={} alt="SUS">
-    <img src={} alt="20 years">
-    <img src={} alt="Footer">
-</div>
-</footer>
-</html>""".format('"' + path.abspath(path.join('figures','sus.png')) + '"',
-  '"' + path.abspath(path.join('figures','20_years.png')) + '"',
-  '"' + path.abspath(path.join('figures','footer.png')) + '"')
-    
-    return html_content
-  
-def run_model(demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None):
-  model = Model(Data(demand, equipment_rates, staff_rates, consumable_rates))
-  with open('output.html', 'w') as file:
-    html = model.to_html()
-    file.write(model.to_html())
-  return html
+  def to_dict(self, facilities = None):
+    # Machine-readable solution: x and y of every hospital with its nonzero
+    # acquisitions (z), repairs (w) and transfers (v), plus the solver outcome
+    if facilities is None:
+      facilities = self.extract_solution()
+    hospital_ids = self.data.data_reader.get_hospital_ids()
+    hospitals = []
+    for facility in facilities:
+      hospitals.append({
+        'facility': facility['facility'],
+        'hospital_id': hospital_ids[facility['facility']],
+        'x': facility['x'],
+        'y': facility['y'],
+        'z': [dict(self.requirement_ref(j), quantity=quantity)
+          for j, quantity in facility['acquire'].items()],
+        'w': [dict(self.requirement_ref(j), quantity=quantity)
+          for j, quantity in facility['repair'].items()],
+        'v': [dict(self.requirement_ref(transfer['requirement']),
+          to_hospital_id=hospital_ids[transfer['facility']], quantity=transfer['quantity'])
+          for transfer in facility['send']]
+      })
+    return {
+      'objective': pyo.value(self.model.objective),
+      'status': self.status,
+      'gap': self.gap,
+      'hospitals': hospitals
+    }
+
+  def to_json(self, facilities = None):
+    return json.dumps(self.to_dict(facilities), separators=(',', ':'))
+
+  def to_html(self, facilities = None):
+    start = time.perf_counter()
+    html = ''.join(self.render_html(facilities))
+    self.render_time = time.perf_counter() - start
+    return html
+
+class MatrixModel(Model):
+  # Same formulation as Model, assembled directly as a sparse matrix and passed to
+  # HiGHS, without building Pyomo expressions. The solution is exposed through
+  # self.model with the same names as the Pyomo model, so print_solution and
+  # to_html work unchanged.
+  def build(self):
+    data = self.data
+    nF = len(data.F)
+    nR = len(data.R)
+    nJ = len(data.R) + len(data.U) # R + U are the consecutive indices 0..nJ-1
+    inf = highspy.kHighsInf
+
+    a = np.array(data.a, dtype=float).reshape(nF, nJ)
+    m = np.array(data.m, dtype=float).reshape(nF, nR)
+    n = np.array(data.n, dtype=float)
+    t = np.array(data.t, dtype=float).reshape(nJ, nF, nF)
+
+    # Transfer arcs (j, i, l): requirement j sent from facility i to facility l
+    arcs = np.array(self.arcs, dtype=int).reshape(-1, 3)
+    self.arc_j, self.arc_i, self.arc_l = arcs[:, 0], arcs[:, 1], arcs[:, 2]
+    nV = len(self.arc_j)
+
+    # Column layout: x[i] | y[i] | z[i, j] | w[i, j] | v[arc]
+    self.x_col = 0
+    self.y_col = self.x_col + nF
+    self.z_col = self.y_col + nF
+    self.w_col = self.z_col + nF*nJ
+    self.v_col = self.w_col + nF*nR
+    num_col = self.v_col + nV
+
+    self.col_cost = np.concatenate([np.zeros(nF), np.array(data.c, dtype=float),
+      np.tile(np.array(data.p, dtype=float), nF), m.ravel(),
+      t[self.arc_j, self.arc_i, self.arc_l]])
+    self.col_lower = np.zeros(num_col)
+    self.col_upper = np.concatenate([np.array(data.u, dtype=float), np.ones(nF),
+      np.full(nF*nJ, inf), m.ravel(), a[self.arc_i, self.arc_j]])
+    self.col_lower[self.y_col + np.array(data.K, dtype=int)] = 1 # y_fix_constraint
+
+    # Row layout: demand | requirement (i, j) | l[i]*y[i] - x[i] <= 0 |
+    #   x[i] - u[i]*y[i] <= 0 | y[i] - x[i] <= 0
+    req_row = 1
+    bed_row = req_row + nF*nJ
+    y_upper_row = bed_row + nF
+    y_lower_row = y_upper_row + nF
+    num_row = y_lower_row + nF
+
+    facilities = np.arange(nF)
+    req_i, req_j = np.meshgrid(facilities, np.arange(nJ), indexing='ij')
+    req_i, req_j = req_i.ravel(), req_j.ravel()
+    rep_i, rep_j = req_i[req_j < nR], req_j[req_j < nR]
+    arc_out_row = req_row + self.arc_i*nJ + self.arc_j
+    arc_in_row = req_row + self.arc_l*nJ + self.arc_j
+    arc_cols = self.v_col + np.arange(nV)
+
+    rows = np.concatenate([
+      np.zeros(nF, dtype=int), # demand: sum x[i]
+      req_row + req_i*nJ + req_j, # + z[i, j]
+      req_row + rep_i*nJ + rep_j, # + w[i, j]
+      req_row + req_i*nJ + req_j, # - n[j]*x[i]
+      arc_in_row, # + v[j, l, i]
+      arc_out_row, # - v[j, i, l]
+      bed_row + facilities, bed_row + facilities,
+      y_upper_row + facilities, y_upper_row + facilities,
+      y_lower_row + facilities, y_lower_row + facilities])
+    cols = np.concatenate([
+      self.x_col + facilities,
+      self.z_col + req_i*nJ + req_j,
+      self.w_col + rep_i*nR + rep_j,
+      self.x_col + req_i,
+      arc_cols,
+      arc_cols,
+      self.y_col + facilities, self.x_col + facilities,
+      self.x_col + facilities, self.y_col + facilities,
+      self.y_col + facilities, self.x_col + facilities])
+    vals = np.concatenate([
+      np.ones(nF),
+      np.ones(nF*nJ),
+      np.ones(len(rep_i)),
+      -n[req_j],
+      np.ones(nV),
+      -np.ones(nV),
+      np.array(data.l, dtype=float), -np.ones(nF),
+      np.ones(nF), -np.array(data.u, dtype=float),
+      np.ones(nF), -np.ones(nF)])
+
+    self.row_lower = np.concatenate([[data.d], -a.ravel(), np.full(3*nF, -inf)])
+    self.row_upper = np.concatenate([[inf], np.full(nF*nJ, inf), np.zeros(3*nF)])
+
+    # COO -> CSR
+    order = np.lexsort((cols, rows))
+    self.a_index = cols[order].astype(np.int32)
+    self.a_value = vals[order]
+    self.a_start = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=num_row))]).astype(np.int32)
+    self.num_col = num_col
+    self.num_row = num_row
+
+  def solve(self):
+    lp = highspy.HighsLp()
+    lp.num_col_ = self.num_col
+    lp.num_row_ = self.num_row
+    lp.col_cost_ = self.col_cost
+    lp.col_lower_ = self.col_lower
+    lp.col_upper_ = self.col_upper
+    lp.row_lower_ = self.row_lower
+    lp.row_upper_ = self.row_upper
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    lp.a_matrix_.num_col_ = self.num_col
+    lp.a_matrix_.num_row_ = self.num_row
+    lp.a_matrix_.start_ = self.a_start
+    lp.a_matrix_.index_ = self.a_index
+    lp.a_matrix_.value_ = self.a_value
+    lp.integrality_ = [highspy.HighsVarType.kInteger]*self.num_col
+
+    self.highs = highspy.Highs()
+    self.highs.passModel(lp)
+    self.highs.run()
+    # Lower case, like Pyomo's termination conditions ('optimal', 'infeasible', ...)
+    self.status = self.highs.modelStatusToString(self.highs.getModelStatus()).lower()
+    self.gap = self.highs.getInfo().mip_gap
+    self.model = self.read_solution()
+
+  def read_solution(self):
+    data = self.data
+    nF = len(data.F)
+    nR = len(data.R)
+    nJ = len(data.R) + len(data.U)
+    values = np.rint(np.array(self.highs.getSolution().col_value)).astype(int).tolist()
+
+    x = {i: values[self.x_col + i] for i in data.F}
+    y = {i: values[self.y_col + i] for i in data.F}
+    z = {(i, j): values[self.z_col + i*nJ + j] for i in data.F for j in data.R + data.U}
+    w = {(i, j): values[self.w_col + i*nR + j] for i in data.F for j in data.R}
+    v = {(j, i, l): values[self.v_col + k] for k, (j, i, l) in
+      enumerate(zip(self.arc_j.tolist(), self.arc_i.tolist(), self.arc_l.tolist()))}
+    return SimpleNamespace(F=data.F, R=data.R, U=data.U, K=data.K, x=x, y=y, z=z, w=w, v=v,
+      objective=self.highs.getInfo().objective_function_value)
+
+MODEL_BACKENDS = {'pyomo': Model, 'matrix': MatrixModel}
+
+class PersistentModel:
+  # Keeps one Pyomo model alive between requests. Requests that only change the
+  # demand or the necessary rates update it in place and re-solve; it is rebuilt
+  # when anything else (facilities, requirements, stock, costs) changes.
+  def __init__(self):
+    # Callers hold the lock from solve() until they are done with the model
+    self.lock = threading.RLock()
+    self.key = None
+    self.model = None
+
+  def solve(self, data, transfer_graph = None):
+    key = (data.structure_key(), json.dumps(transfer_graph or {}, sort_keys=True))
+    with self.lock:
+      if self.model is not None and self.key == key:
+        self.model.update(data)
+      else:
+        self.model = Model(data, transfer_graph)
+        self.key = key
+      return self.model
+
+persistent_model = PersistentModel()
+
+solution_cache = SolutionCache()
+
+def normalize_rates(rates):
+  # Keeps the key type: ReadData only applies overrides whose key matches the id type
+  if not rates:
+    return None
+  return sorted([type(id).__name__, str(id), rate] for id, rate in rates.items())
+
+def input_version(data_reader):
+  # Version stamp of the inputs every solution depends on: the spreadsheet and the
+  # transfer costs. The cache is emptied only when it changes.
+  with open(path.join('src','data','transfer_costs.txt'), 'rb') as file_object:
+    return [data_reader.version, hashlib.sha256(file_object.read()).hexdigest()]
+
+def demand_version(demand = None):
+  # The default demand comes from next month's forecast, so its solutions also
+  # depend on the month and on the forecast file; an explicit demand does not
+  if demand:
+    return None
+  forecast_file = path.join('src','data','pred_results','forecast.csv')
+  return [date.today().strftime('%Y-%m'),
+    stat(forecast_file).st_mtime_ns if path.exists(forecast_file) else None]
+
+OUTPUT_FORMATS = ('html', 'json')
+
+def run_model(demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None,
+  backend = 'pyomo', transfer_graph = None, persistent = True, use_cache = True, output = 'html'):
+  # output: 'html' for the report (also written to output.html) or 'json' for the
+  # solution as returned by Model.to_json, without rendering or writing any file
+  if output not in OUTPUT_FORMATS:
+    raise ValueError("output must be one of " + ", ".join(OUTPUT_FORMATS))
+  data_reader = ReadData(equipment_rates, staff_rates, consumable_rates)
+
+  response = None
+  if use_cache:
+    version = input_version(data_reader)
+    solution_cache.check_version(json.dumps(version))
+    key = solution_cache.key({'demand': demand or None, 'demand_version': demand_version(demand),
+      'equipment_rates': normalize_rates(equipment_rates),
+      'staff_rates': normalize_rates(staff_rates),
+      'consumable_rates': normalize_rates(consumable_rates),
+      'backend': backend, 'transfer_graph': transfer_graph, 'output': output}, version)
+    response = solution_cache.get(key)
+
+  if response is None:
+    data = Data(demand, equipment_rates, staff_rates, consumable_rates, data_reader)
+    if backend == 'pyomo' and persistent:
+      with persistent_model.lock:
+        model = persistent_model.solve(data, transfer_graph)
+        response = model.to_json() if output == 'json' else model.to_html()
+    else:
+      model = MODEL_BACKENDS[backend](data, transfer_graph)
+      response = model.to_json() if output == 'json' else model.to_html()
+    if use_cache:
+      solution_cache.put(key, response)
+
+  if output == 'html':
+    with open('output.html', 'w') as file:
+      file.write(response)
+  return response
+
+def prescriptive_job(demand = None, equipment_rates = None, staff_rates = None, consumable_rates = None,
+  output = 'json'):
+  # Job function. A job process lives for a single solve, so keeping the persistent
+  # model is pointless
+  return run_model(demand, equipment_rates, staff_rates, consumable_rates, persistent=False,
+    output=output)
+
+def solve_scenario(data, backend = 'pyomo', transfer_graph = None, full_solution = False):
+  # Runs in a worker process of run_scenarios
+  model = MODEL_BACKENDS[backend](data, transfer_graph)
+  facilities = model.extract_solution()
+  summary = model.summary(facilities)
+  if full_solution:
+    summary['solution'] = facilities
+  return summary
+
+_scenario_executor = None
+_scenario_executor_lock = threading.Lock()
+
+def get_scenario_executor():
+  # One pool per process, shared by every batch request, so concurrent requests
+  # queue their scenarios instead of each starting cpu_count() processes. Its
+  # workers come from the fork server, not from a fork of the multithreaded web
+  # process.
+  global _scenario_executor
+  with _scenario_executor_lock:
+    if _scenario_executor is None:
+      _scenario_executor = ProcessPoolExecutor(max_workers=cpu_count() or 1, mp_context=context)
+    return _scenario_executor
+
+def drop_scenario_executor(executor):
+  # A pool whose worker died refuses new work; the next batch starts a new one
+  global _scenario_executor
+  with _scenario_executor_lock:
+    if _scenario_executor is executor:
+      _scenario_executor = None
+  executor.shutdown(wait=False)
+
+def run_scenarios(scenarios, full_solutions = False, backend = 'pyomo', transfer_graph = None):
+  # scenarios: list of {demand, equipment_rates, staff_rates, consumable_rates}. The
+  # data is read once and the scenarios are solved in parallel on the shared pool.
+  if not scenarios:
+    return []
+  # The forecast is only needed when some scenario leaves the demand out
+  needs_forecast = any(not scenario.get('demand') for scenario in scenarios)
+  base = Data(None if needs_forecast else scenarios[0]['demand'])
+  datas = [base.scenario(scenario.get('demand'), scenario.get('equipment_rates'),
+    scenario.get('staff_rates'), scenario.get('consumable_rates')) for scenario in scenarios]
+
+  executor = get_scenario_executor()
+  try:
+    futures = [executor.submit(solve_scenario, data, backend, transfer_graph, full_solutions)
+      for data in datas]
+    return [future.result() for future in futures]
+  except BrokenProcessPool:
+    drop_scenario_executor(executor)
+    raise
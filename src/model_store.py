@@ -0,0 +1,58 @@
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+from .files import data_path, atomic_write
+
+class ModelStore:
+    # Fitted forecasting models saved as pickles named after a version key, so a
+    # model is only refit when the hyperparameters or the training data change
+    def __init__(self, path=os.path.join(data_path, 'models'), max_artifacts=8):
+        self.path = path
+        self.max_artifacts = max_artifacts
+        os.makedirs(self.path, exist_ok=True)
+
+    def data_version(self, data):
+        # Date range and size of the data plus a hash of its contents
+        content_hash = int(pd.util.hash_pandas_object(data, index=False).sum())
+        return {
+            'start': str(data['ds'].min()),
+            'end': str(data['ds'].max()),
+            'rows': len(data),
+            'hash': content_hash
+        }
+
+    def key(self, stage, params, data):
+        content = json.dumps({'stage': stage, 'params': params, 'data': self.data_version(data)},
+                             sort_keys=True)
+        return stage + '-' + hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def load(self, key):
+        # Any artifact that cannot be read is a miss, including one truncated or pickled
+        # by other versions of mlforecast, xgboost or lightgbm (AttributeError,
+        # ModuleNotFoundError, ...), so that it is simply fitted and saved again
+        try:
+            with open(self.file(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            print("Could not load model artifact", key + ":", repr(err))
+            return None
+
+    def save(self, key, artifact):
+        with atomic_write(self.file(key)) as tmp_file:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.prune()
+
+    def prune(self):
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.pkl')]
+        files.sort(key=os.path.getmtime)
+        for file in files[:max(0, len(files) - self.max_artifacts)]:
+            os.remove(file)
@@ -10,18 +10,35 @@ from sklearn.metrics import mean_absolute_error
 import os
 from datetime import datetime
 import json
-import random
 import calendar
-
-current_directory = os.path.dirname(os.path.abspath(__file__))
-data_path = os.path.join(current_directory, 'data')
+import hashlib
+import threading
+import copy
+
+from .model_store import ModelStore
+from .backtesting import Backtest
+from .forecast_store import ForecastStore
+from .cache import LRUCache
+from .transmission_rate import TransmissionRate
+from .processes import context
+from . import columnar
+from .files import data_path, atomic_write
+
+# Trials counted towards N_TRIALS when a tuning study is resumed
+FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
 
 class Predictive:
     def __init__(self):
         print("Predictive class initialized")
 
         self.N_TRIALS = 30
+        self.TUNING_MODE = 'parallel' # 'parallel': resumable, pruned, multi-process; 'serial': in-memory, multi-objective
+        self.TUNING_STORAGE = os.path.join(data_path, 'optuna', 'tuning.journal')
+        self.NUM_THREADS = 6 # threads of each tuning worker; workers = cores // NUM_THREADS
+        self.model_threads = None # n_jobs of the regressors, None for the libraries' default
         self.HORIZON = 30
+        self.MAX_STALENESS_DAYS = 60 # refit when the last full fit is older than this (in days of data)
+        self.DRIFT_FACTOR = 2.0 # refit when the wMAPE on new data exceeds this times the validation wMAPE
         self.MODEL = ["LGBMRegressor", "XGBRegressor"]
         self.static_features = ['is_holiday']
         self.data_file = os.path.join(data_path, 'dados-gerais.csv')
@@ -34,20 +51,62 @@ class Predictive:
 
         self.train, self.valid = self.get_train_test()
         self.valid_horizon = self.valid['ds'].nunique()
+        self.model_store = ModelStore()
+        self.dataset_version = json.dumps(self.model_store.data_version(self.dataset), sort_keys=True)
         self.best_params = self.get_bests_from_json()
         self.best_models = None
+        self.validation_metrics = None
+        self.fitted = None # MLForecast fitted on the whole dataset
         self.forecast = None
-
-        self.data_to_export = None
+        self.forecast_store = ForecastStore()
+        self.contamination_cache = LRUCache(max_entries=64)
+        self.transmission_rate = TransmissionRate()
+
+        if not self.load_artifacts():
+            self.update_forecaster()
+
+    def __getstate__(self):
+        # Worker processes (tuning, backtest folds) only need the data and the settings;
+        # the fitted models are large and the stores and caches hold locks
+        state = self.__dict__.copy()
+        for name in ('fitted', 'forecast', 'forecast_store', 'contamination_cache', 'transmission_rate'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.fitted = None
+        self.forecast = None
+        self.forecast_store = ForecastStore()
+        self.contamination_cache = LRUCache(max_entries=64)
+        self.transmission_rate = TransmissionRate()
 
     def get_bests_from_json(self):
         try:
             best_params_json = os.path.join(data_path, 'last_best_params.json')
             with open(best_params_json, 'r') as f:
-                self.best_params = json.load(f)
+                return json.load(f)
         except:
-            self.best_params = self.optimize()
-        
+            return self.optimize()
+
+    def last_best_params(self):
+        try:
+            with open(os.path.join(data_path, 'last_best_params.json'), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load_artifacts(self):
+        # Picks up the models fitted for the current params and data, if any.
+        # Returns whether both the validation and the full models were found.
+        validation = self.model_store.load(self.model_store.key('validation', self.best_params, self.dataset))
+        full = self.model_store.load(self.model_store.key('full', self.best_params, self.dataset))
+        if validation is not None:
+            self.best_models = validation['best_models']
+            self.validation_metrics = validation['metrics']
+        if full is not None:
+            self.fitted = full['forecast']
+        return validation is not None and full is not None
 
     def get_train_test(self):
         two_months_ago = self.max_date - pd.DateOffset(months=2)
@@ -68,7 +127,7 @@ class Predictive:
             lag_transforms={
                 1: [(rolling_mean, 7), (rolling_max, 7), (rolling_min, 7)],
             },
-            num_threads=6
+            num_threads=self.NUM_THREADS
         )
     
     def models_(self, params):
@@ -80,6 +139,7 @@ class Predictive:
                 min_child_weight=params['min_child_weight'],
                 subsample=params['subsample'],
                 colsample_bytree=params['colsample_bytree'],
+                n_jobs=self.model_threads,
                 random_state=42
             ),
             LGBMRegressor(
@@ -90,24 +150,58 @@ class Predictive:
                 bagging_fraction=params['bagging_fraction'],
                 colsample_bytree=params['colsample_bytree'],
                 bagging_freq=1,
+                n_jobs=self.model_threads,
                 random_state=42,
                 verbose=-1)
         ]
 
     def get_data(self, path):
-        br_holidays = holidays.country_holidays('BR')
-        data = pd.read_csv(path)
+        # The cleaned frame is kept in parquet next to the CSV, keyed by the CSV's
+        # modification time and size, so a warm start skips parsing it
+        cache_file = self.preprocessed_file(path)
+        if os.path.exists(cache_file):
+            return pd.read_parquet(cache_file)
+
+        if columnar.is_fresh(path):
+            raw = columnar.read(path, 'cases')
+            raw['ra'] = raw['ra'].astype(str)
+        else:
+            raw = pd.read_csv(path)
+        data = self.preprocess(raw)
+
+        cache_dir = os.path.dirname(cache_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):
+            if name.startswith(os.path.basename(path) + '.'):
+                os.remove(os.path.join(cache_dir, name))
+        with atomic_write(cache_file) as tmp_file:
+            data.to_parquet(tmp_file, index=False)
+
+        return data
+
+    def preprocessed_file(self, path):
+        stat = os.stat(path)
+        return os.path.join(data_path, 'preprocessed',
+                            f'{os.path.basename(path)}.{stat.st_mtime_ns}.{stat.st_size}.parquet')
+
+    def preprocess(self, data):
         data = data.rename(columns= {'date': 'ds', 'case_cnt': 'y', 'ra': 'unique_id'})
         data['ds'] = pd.to_datetime(data['ds'])
-        
-        data = data.sort_values(by=['unique_id', 'ds'])
-        
-        data = data.groupby('unique_id').apply(lambda x: x.fillna(method='ffill')).reset_index(drop=True)
-        data['is_holiday'] = data['ds'].dt.date.apply(lambda x: 1 if x in br_holidays else 0)
+
+        data = data.sort_values(by=['unique_id', 'ds']).reset_index(drop=True)
+
+        columns = [column for column in data.columns if column != 'unique_id']
+        data[columns] = data.groupby('unique_id')[columns].ffill()
+
+        # Holidays are looked up once per distinct date
+        br_holidays = holidays.country_holidays('BR')
+        dates = pd.DatetimeIndex(data['ds'].dropna().unique())
+        holiday_dates = [date for date in dates if date.date() in br_holidays]
+        data['is_holiday'] = data['ds'].isin(holiday_dates).astype(int)
 
         return data
 
-    def objective(self, trial):
+    def suggest_params(self, trial):
         learning_rate = trial.suggest_float('learning_rate', 1e-3, 1e-1, log=True)
         lags = trial.suggest_int('lags', 14, 56, step=7)# step means we only try multiples of 7 starting from 14
         colsample_bytree = trial.suggest_float('colsample_bytree', 0.1, 1.0)
@@ -122,8 +216,9 @@ class Predictive:
         subsample = trial.suggest_float('subsample', 0.1, 1.0)
         max_depth = trial.suggest_int('max_depth', 3, 10)
 
-        models = self.models_({
+        return {
             'learning_rate': learning_rate,
+            'lags': lags,
             'num_leaves': num_leaves,
             'min_data_in_leaf': min_data_in_leaf,
             'bagging_fraction': bagging_fraction,
@@ -131,35 +226,107 @@ class Predictive:
             'min_child_weight': min_child_weight,
             'subsample': subsample,
             'max_depth': max_depth
-        })
-    
-        forecast = self.train_forecast(models, lags)
+        }
+
+    def objective(self, trial):
+        params = self.suggest_params(trial)
+        forecast = self.train_forecast(self.models_(params), params['lags'])
 
         error_lgbm = mean_absolute_error(forecast['y'], forecast[self.MODEL[0]])
         error_xgb = mean_absolute_error(forecast['y'], forecast[self.MODEL[1]])
 
         return error_lgbm, error_xgb
 
+    def pruned_objective(self, trial):
+        # Mean MAE of both regressors. LightGBM is fitted and reported first, so a
+        # trial that is already worse than the median stops before XGBoost is fitted.
+        params = self.suggest_params(trial)
+        errors = []
+        for step, model in enumerate(reversed(self.models_(params))):
+            forecast = self.train_forecast([model], params['lags'])
+            errors.append(mean_absolute_error(forecast['y'], forecast[type(model).__name__]))
+            trial.report(np.mean(errors), step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+        return np.mean(errors)
+
     def optimize(self):
         optuna.logging.set_verbosity(optuna.logging.WARNING)
-        
-        if os.path.getsize(os.path.join(data_path, 'last_best_params.json')) > 0:
-            self.best_params = self.get_bests_from_json()
 
-        study = optuna.create_study(directions=['minimize', 'minimize'])
-        study.optimize(self.objective, n_trials=self.N_TRIALS)
-        best_params_json = os.path.join(data_path, 'last_best_params.json')
+        if self.TUNING_MODE == 'parallel':
+            best_params = self.optimize_parallel()
+        else:
+            study = optuna.create_study(directions=['minimize', 'minimize'])
+            study.optimize(self.objective, n_trials=self.N_TRIALS)
+            best_params = study.best_trials[0].params
 
+        best_params_json = os.path.join(data_path, 'last_best_params.json')
         with open(best_params_json, 'w') as f:
-            json.dump(study.best_trials[0].params, f)
+            json.dump(best_params, f)
+
+        return best_params
+
+    def tuning_storage(self):
+        os.makedirs(os.path.dirname(self.TUNING_STORAGE), exist_ok=True)
+        return optuna.storages.JournalStorage(optuna.storages.JournalFileStorage(self.TUNING_STORAGE))
+
+    def tuning_study(self, study_name):
+        # Samplers and pruners are not persisted, so every worker passes its own.
+        # constant_liar keeps concurrent workers from sampling the same region.
+        return optuna.create_study(
+            study_name=study_name,
+            storage=self.tuning_storage(),
+            direction='minimize',
+            sampler=optuna.samplers.TPESampler(constant_liar=True),
+            pruner=optuna.pruners.MedianPruner(n_startup_trials=5),
+            load_if_exists=True
+        )
+
+    def study_name(self):
+        # One study per training set: a study interrupted on the same data is resumed
+        version = json.dumps(self.model_store.data_version(self.train), sort_keys=True)
+        return 'contamination-' + hashlib.sha256(version.encode('utf-8')).hexdigest()[:16]
+
+    def finished_trials(self, study):
+        return len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+
+    def optimize_parallel(self):
+        study_name = self.study_name()
+        study = self.tuning_study(study_name)
+
+        last_best_params = self.last_best_params()
+        if last_best_params is not None:
+            study.enqueue_trial(last_best_params, skip_if_exists=True)
+
+        workers = max(1, (os.cpu_count() or 1) // self.NUM_THREADS)
+        # Started by the fork server: forking after the regressors have run in this
+        # process (their OpenMP thread pools) can hang LightGBM in the child. Each
+        # worker receives this Predictive pickled, without its fitted models and stores.
+        processes = [context.Process(target=self.tuning_worker, args=(study_name,)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
 
-        return study.best_trials[0].params
+        return self.tuning_study(study_name).best_params
 
-    def train_forecast(self, models, lags):
+    def tuning_worker(self, study_name):
+        optuna.logging.set_verbosity(optuna.logging.WARNING)
+        self.model_threads = self.NUM_THREADS
+        study = self.tuning_study(study_name)
+        if self.finished_trials(study) >= self.N_TRIALS:
+            return
+        study.optimize(self.pruned_objective,
+                       callbacks=[optuna.study.MaxTrialsCallback(self.N_TRIALS, states=FINISHED_STATES)])
+
+    def train_forecast(self, models, lags, train=None, valid=None):
+        # Fits on train and forecasts the days of valid (by default the holdout split)
+        if train is None:
+            train, valid = self.train, self.valid
         instances = self.create_instances(models, lags)
-        instances.fit(self.train, id_col='unique_id', target_col='y', time_col='ds', static_features=self.static_features)
-        forecast = instances.predict(h=self.valid_horizon)
-        forecast = forecast.merge(self.valid[['unique_id', 'ds', 'y']], on=['unique_id', 'ds'], how='left')
+        instances.fit(train, id_col='unique_id', target_col='y', time_col='ds', static_features=self.static_features)
+        forecast = instances.predict(h=valid['ds'].nunique())
+        forecast = forecast.merge(valid[['unique_id', 'ds', 'y']], on=['unique_id', 'ds'], how='left')
         forecast['y'] = forecast['y'].fillna(0)
         forecast['y'] = forecast['y'].astype(int)
         return forecast
@@ -180,105 +347,200 @@ class Predictive:
         forecast_model.to_csv(file_to_save, index=False)  
 
     def calculate_metrics_for_ra(self, forecast):
-        return forecast.groupby('unique_id').apply(lambda x: self.metrics(x))
+        # Tidy table with one row per RA and model of self.MODEL: unique_id, model, wmape, mae
+        errors = forecast[self.MODEL].sub(forecast['y'], axis=0).abs()
+        by_ra = forecast['unique_id']
+        error_sums = errors.groupby(by_ra).sum()
+        table = pd.DataFrame({
+            'wmape': error_sums.div(forecast['y'].abs().groupby(by_ra).sum(), axis=0).stack(),
+            'mae': error_sums.div(by_ra.groupby(by_ra).size(), axis=0).stack()
+        })
+        table.index.names = ['unique_id', 'model']
+        return table.reset_index()
 
-    def choose_best_model(self, forecast):
-        metrics = self.calculate_metrics_for_ra(forecast)
-        best_model = metrics.apply(lambda x: 'LGBMRegressor' if x['lightgbm']['mae'] < x['xgboost']['mae'] else 'XGBRegressor')
-        
+    def select_best_models(self, metrics):
+        # Model with the lowest MAE of each RA, from a table like calculate_metrics_for_ra's
+        return metrics.pivot(index='unique_id', columns='model', values='mae')[self.MODEL].idxmin(axis=1)
 
-        self.best_models = best_model
-        
-    
     def train_for_metrics(self):
+        key = self.model_store.key('validation', self.best_params, self.dataset)
+        artifact = self.model_store.load(key)
+        if artifact is not None:
+            self.best_models = artifact['best_models']
+            self.validation_metrics = artifact['metrics']
+            return
+
         forecast = self.train_forecast(self.models_(self.best_params), self.best_params['lags'])
-        self.choose_best_model(forecast)
+        self.validation_metrics = self.metrics(forecast)
 
-        metrics_ = self.metrics(forecast)
+        # The regressor of each RA is chosen on the average of several rolling folds
+        # rather than on the holdout window alone
+        self.best_models = Backtest(self).best_models(self.best_params)
 
         for model in self.MODEL:
             self.save_csv(forecast, model)
-    
-    def predict(self):
+
+        self.model_store.save(key, {'best_models': self.best_models, 'metrics': self.validation_metrics})
+
+    def fit(self):
+        # Fits on the whole dataset unless a model for the same params and data is stored
+        key = self.model_store.key('full', self.best_params, self.dataset)
+        artifact = self.model_store.load(key)
+        if artifact is not None:
+            self.fitted = artifact['forecast']
+            return
+
         model = self.models_(self.best_params)
         instances = self.create_instances(model, self.best_params['lags'])
         dataset_to_predict = self.dataset[['unique_id', 'ds', 'y', 'is_holiday']]
         instances.fit(dataset_to_predict, id_col='unique_id', target_col='y', time_col='ds', static_features=self.static_features)
-        forecast = instances.predict(h=self.HORIZON)
+        self.fitted = instances
+
+        self.model_store.save(key, {'forecast': instances})
+        self.model_store.save('full-latest', {
+            'forecast': instances,
+            'params': self.best_params,
+            'best_models': self.best_models,
+            'metrics': self.validation_metrics,
+            'fit_end': self.max_date, # last day of the data of the full fit
+            'data_end': self.max_date # last day of the data in the fitted state
+        })
 
-        if self.best_models is not None:
-            final_datasets = []
-            for ra in forecast['unique_id'].unique():
-                model = self.best_models[ra]
-                temp_df = temp_df = forecast.loc[forecast['unique_id'] == ra, ['unique_id', 'ds', model]].copy() 
-                final_datasets.append(temp_df)
-            
-            final_dataset = pd.concat(final_datasets, ignore_index=True)
+    def update_forecaster(self):
+        # Brings the last fitted MLForecast up to the current data by appending the
+        # new observations to its series, without refitting the regressors. Returns
+        # False when there is nothing to update or a refit is due (stale or drifted).
+        latest = self.model_store.load('full-latest')
+        if latest is None or latest['params'] != self.best_params:
+            return False
+        if (self.max_date - latest['fit_end']).days > self.MAX_STALENESS_DAYS:
+            print("Fitted models are stale, refitting")
+            return False
+
+        new_data = self.dataset[self.dataset['ds'] > latest['data_end']]
+        if self.drifted(new_data, latest['metrics']):
+            print("Forecast drifted from the new data, refitting")
+            return False
+
+        if len(new_data) > 0:
+            try:
+                latest['forecast'].update(new_data[['unique_id', 'ds', 'y', 'is_holiday']])
+            except Exception as err:
+                print("Could not update the fitted models:", err)
+                return False
+            latest['data_end'] = self.max_date
+            self.model_store.save('full-latest', latest)
+
+        self.fitted = latest['forecast']
+        self.best_models = latest['best_models']
+        self.validation_metrics = latest['metrics']
+        return True
+
+    def drifted(self, new_data, metrics):
+        # Compares the new observations with what forecast.csv predicted for them
+        if len(new_data) == 0 or not metrics:
+            return False
+        self.read_forecast()
+        observed = new_data[['unique_id', 'ds', 'y']].merge(self.forecast, on=['unique_id', 'ds'])
+        if len(observed) == 0 or observed['y'].abs().sum() == 0:
+            return False
+        error = self.wmape(observed['y'], observed['y_hat'])
+        baseline = min(model_metrics['mape'] for model_metrics in metrics.values())
+        return error > self.DRIFT_FACTOR * baseline
 
-            final_dataset['y_hat'] = final_dataset['XGBRegressor'].combine_first(final_dataset['LGBMRegressor'])
-            final_dataset = final_dataset[['unique_id', 'ds', 'y_hat']]
-            final_dataset['y_hat'] = final_dataset['y_hat'].astype(int)
-            final_dataset.to_csv(os.path.join(data_path, 'pred_results', 'forecast.csv'), index=False)
+    def predict(self):
+        if self.fitted is None:
+            self.fit()
+        forecast = self.fitted.predict(h=self.HORIZON)
+
+        if self.best_models is not None:
+            # Each row takes the column of its RA's best model
+            columns = forecast['unique_id'].map(self.best_models).map({model: i for i, model in enumerate(self.MODEL)})
+            predictions = forecast[self.MODEL].to_numpy()
+            final_dataset = forecast[['unique_id', 'ds']].copy()
+            final_dataset['y_hat'] = predictions[np.arange(len(forecast)), columns.to_numpy()].astype(int)
+            self.forecast_store.write(final_dataset)
     
     def read_forecast(self):
-        file_path = os.path.join(data_path, 'pred_results', 'forecast.csv')
-        try:
-            self.forecast = pd.read_csv(file_path)
-        except:
-            self.forecast = pd.DataFrame(columns=['unique_id', 'ds', 'y_hat'])
+        self.forecast = self.forecast_store.get()
         
     def contamination(self, horizon, prescriptive=False):
+        # Payloads are memoized: the answer for a horizon only changes with the day,
+        # the dataset or the forecast, all of which are part of the key
         if horizon > 3:
             return 404
+        payload = self.contamination_cache.get(self.contamination_key(horizon, prescriptive))
+        if payload is None:
+            payload = self.compute_contamination(horizon, prescriptive)
+            # The forecast may have just been created, so the key is taken again
+            self.contamination_cache.put(self.contamination_key(horizon, prescriptive), payload)
+        return copy.deepcopy(payload) if prescriptive else payload
+
+    def contamination_key(self, horizon, prescriptive):
+        today = pd.to_datetime('today').strftime('%Y-%m-%d')
+        return (horizon, prescriptive, today, self.dataset_version, self.forecast_store.version())
+
+    def transmission_rates(self):
+        # R_t of every RA and day, over the observed cases followed by the forecast
+        forecast = self.forecast_store.get()
+        future = forecast[forecast['ds'] > self.max_date].rename(columns={'y_hat': 'y'})
+        cases = pd.concat([self.dataset[['unique_id', 'ds', 'y']], future[['unique_id', 'ds', 'y']]])
+        return self.transmission_rate.estimate(cases, (self.dataset_version, self.forecast_store.version()))
+
+    def with_transmission_rate(self, data):
+        rates = self.transmission_rates().rename(columns={'rt': 'transmission_rate'})
+        return data.merge(rates, on=['unique_id', 'ds'], how='left')
+
+    def compute_contamination(self, horizon, prescriptive=False):
         if horizon < 0:
             today = pd.to_datetime('today')
             start_date = today + pd.DateOffset(months=horizon)
             month_end_day = calendar.monthrange(start_date.year, start_date.month)[1]
             end_date = start_date.replace(day=month_end_day)
 
-            self.data_to_export = self.dataset[(self.dataset['ds'] >= start_date) & (self.dataset['ds'] <= end_date)]
-            self.data_to_export['transmission_rate'] = [random.uniform(0.5, 1.0) for _ in range(len(self.data_to_export))]
-            self.data_to_export = self.data_to_export[['unique_id', 'ds', 'y', 'death_cnt', 'transmission_rate']].reset_index(drop=True)
+            data_to_export = self.dataset[(self.dataset['ds'] >= start_date) & (self.dataset['ds'] <= end_date)]
+            data_to_export = self.with_transmission_rate(data_to_export)
+            data_to_export = data_to_export[['unique_id', 'ds', 'y', 'death_cnt', 'transmission_rate']].reset_index(drop=True)
 
         elif horizon == 0:
             today = pd.to_datetime('today')
             start_date = today.replace(day=1)
-            self.data_to_export = self.dataset[(self.dataset['ds'] >= start_date) & (self.dataset['ds'] <= today)]
-            self.data_to_export['transmission_rate'] = [random.uniform(0.5, 1.0) for _ in range(len(self.data_to_export))]
-            self.data_to_export = self.data_to_export[['unique_id', 'ds', 'y', 'death_cnt', 'transmission_rate']].reset_index(drop=True)
+            data_to_export = self.dataset[(self.dataset['ds'] >= start_date) & (self.dataset['ds'] <= today)]
+            data_to_export = self.with_transmission_rate(data_to_export)
+            data_to_export = data_to_export[['unique_id', 'ds', 'y', 'death_cnt', 'transmission_rate']].reset_index(drop=True)
         else:
             today = pd.to_datetime('today')
             
             future_date = today.replace(day=1) + pd.DateOffset(months=horizon)
             last_day_of_month = calendar.monthrange(future_date.year, future_date.month)[1]
             future_date = future_date.replace(day=last_day_of_month)
-            self.read_forecast()
-            forecast_max_date = pd.to_datetime(self.forecast['ds'].max())
+            forecast_max_date = self.forecast_store.max_date()
 
             if future_date <= forecast_max_date:
                 print("Forecast already exists")
-                start_date = future_date.replace(day=1)
-                print(f"\tStart date: {start_date}\t|\tFuture date: {future_date}")
-                
-                self.data_to_export = self.forecast.loc[(pd.to_datetime(self.forecast['ds']) >= start_date) & (pd.to_datetime(self.forecast['ds']) <= future_date)].copy()
-                
-
             else:
                 print("Forecast doesn't exist, creating new forecast")
-                self.best_params = self.optimize()
-                self.train_for_metrics()
+                if not self.load_artifacts() and not self.update_forecaster():
+                    # Nothing fitted that can be updated to this data: tune and refit
+                    self.best_params = self.optimize()
+                    self.fitted = None
+                    self.train_for_metrics()
 
                 self.HORIZON = (future_date - self.max_date).days + 1
                 self.predict()
-                self.contamination(horizon)
 
-            self.data_to_export['deaths'] = None
-            self.data_to_export['transmission_rate'] = [random.uniform(0.5, 1.0) for _ in range(len(self.data_to_export))]
+            start_date = future_date.replace(day=1)
+            print(f"\tStart date: {start_date}\t|\tFuture date: {future_date}")
+
+            data_to_export = self.forecast_store.range(start_date, future_date).copy()
+            data_to_export['deaths'] = None
+            data_to_export = self.with_transmission_rate(data_to_export)
+            data_to_export['ds'] = data_to_export['ds'].dt.strftime('%Y-%m-%d')
 
         
         if prescriptive:
-            total_cases = 'y' if 'y' in self.data_to_export.columns else 'y_hat'
-            data = self.data_to_export[['ds', total_cases]]
+            total_cases = 'y' if 'y' in data_to_export.columns else 'y_hat'
+            data = data_to_export[['ds', total_cases]]
             data = data.rename(columns={'ds': 'date', total_cases: 'cases'})
             data['date'] = pd.to_datetime(data['date'])
             data = data.groupby(data['date'].dt.to_period('M')).agg({'cases': 'max'}).reset_index()
@@ -286,4 +548,20 @@ class Predictive:
             return data.to_dict(orient='records')
         
         
-        return self.data_to_export.to_json(orient='records', date_format='iso')
+        return data_to_export.to_json(orient='records', date_format='iso')
+
+_default_predictive = None
+_default_predictive_lock = threading.Lock()
+
+def get_default_predictive():
+    # One Predictive per process, shared by the API and the prescriptive model, so
+    # the dataset, the fitted models and the contamination cache are loaded once
+    global _default_predictive
+    with _default_predictive_lock:
+        if _default_predictive is None:
+            _default_predictive = Predictive()
+        return _default_predictive
+
+def contamination_job(horizon, prescriptive=False):
+    # Job function: a job process loads its own Predictive, from the stored models
+    return get_default_predictive().contamination(horizon, prescriptive)
@@ -0,0 +1,13 @@
+import multiprocessing
+
+# Worker processes (jobs, tuning workers, backtest folds) are started by a fork
+# server instead of being forked from the calling process, which may have request
+# threads holding locks or may already have run the regressors' OpenMP thread pools.
+# Whatever they run is pickled by name, so it must be a module-level function or an
+# instance of a module-level class.
+context = multiprocessing.get_context('forkserver')
+
+# Imported once by the fork server, so that workers start with the models' modules
+# loaded instead of importing them again. The server never preloads __main__, its
+# documented default, since the main path is not passed to it.
+context.set_forkserver_preload(['src.predictive', 'src.min_costs_icu_beds'])
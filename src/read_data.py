@@ -1,39 +1,47 @@
-import os.path
 import math
+import time
+import json
+import hashlib
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from .sheets_client import SheetsClient, get_default_client
+from .sheets_snapshot import get_default_snapshot
+
 class ReadData:
-  def __init__(self, equipment_rates = None, staff_rates = None, consumable_rates = None):
-    # If modifying these scopes, delete the file token.json.
-    self.scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+  HOSPITAL_RANGE = "Hospital!A2:H"
+  EQUIPMENT_RANGE = "Equipamento!A2:F"
+  STAFF_RANGE = "Profissional!A2:E"
+  CONSUMABLE_RANGE = "Insumo!A2:E"
+  BATCH_SIZE = 100 # maximum number of ranges per values.batchGet request
+  FETCH_MODES = ("batch", "concurrent", "sequential")
 
+  def __init__(self, equipment_rates = None, staff_rates = None, consumable_rates = None,
+    service = None, snapshot = None, client = None, fetch_mode = "batch"):
+    if fetch_mode not in self.FETCH_MODES:
+      raise ValueError("fetch_mode must be one of " + ", ".join(self.FETCH_MODES))
+    # batch: values.batchGet requests; concurrent: one values.get per range on the
+    # client's thread pool; sequential: one values.get per range, one after another
+    self.fetch_mode = fetch_mode
     self.spreadsheet_id = "1c75vMr_bDLexPcuf0RcBzCxH_w5XcdSAYW_SGOjHu34"
     
-    self.creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(os.path.join("src","data","token.json")):
-      self.creds = Credentials.from_authorized_user_file(os.path.join("src","data","token.json"),
-        self.scopes)
-    # If there are no (valid) credentials available, let the user log in.
-    if not self.creds or not self.creds.valid:
-      if self.creds and self.creds.expired and self.creds.refresh_token:
-        self.creds.refresh(Request())
-      else:
-        flow = InstalledAppFlow.from_client_secrets_file(
-            os.path.join("src","data","credentials.json"), self.scopes
-        )
-        self.creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-      with open(os.path.join("src","data","token.json"), "w") as token:
-        token.write(self.creds.to_json())
-      
+    # snapshot: True for the process-wide local snapshot, False to always read the
+    # spreadsheet, or a SheetsSnapshot instance. By default the process-wide one,
+    # except with an injected service or client, whose data must never end up in it.
+    if snapshot is None:
+      snapshot = service is None and client is None
+
+    # The process-wide client is shared by every request; a prebuilt service (e.g. a
+    # local fake of the Sheets API) gets its own client and skips authentication
+    if client is None:
+      client = SheetsClient(service) if service is not None else get_default_client()
+    self.client = client
+
+    if snapshot is True:
+      snapshot = get_default_snapshot()
+    self.snapshot = snapshot or None
+    self.version = None # digest of the raw tab contents the data was parsed from
+
     self.hospitals = {
       "ids": [],
       "names": {},
@@ -44,53 +52,135 @@ class ReadData:
       "coord_y": {},
       "built": {}
     }
-    self.read_hospital()
-
     self.equipments = {
       "ids": [],
       "names": {},
       "prices": {},
+      "default_rates": {},
       "necessary_rates": {},
       "maintenance_freqs": {},
       "maintenance_costs": {}
     }
-    self.read_equipment(equipment_rates)
-
     self.staff = {
       "ids": [],
       "teams": {},
       "salaries": {},
+      "shift_hours": {},
+      "default_rates": {},
       "necessary_rates": {}
     }
-    self.read_staff(staff_rates)
-
     self.consumables = {
       "ids": [],
       "names": {},
       "prices": {},
+      "default_rates": {},
       "necessary_rates": {}
     }
-    self.read_consumable(consumable_rates)
-
     self.hospital_equipments = {}
     self.hospital_staff = {}
     self.hospital_consumables = {}
+
+    self.read_all(equipment_rates, staff_rates, consumable_rates)
+
+  def read_all(self, equipment_rates = None, staff_rates = None, consumable_rates = None):
+    values = self.load_ranges()
+    self.version = hashlib.sha256(json.dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+    self.read_hospital(values[self.HOSPITAL_RANGE])
+    self.read_equipment(equipment_rates, values[self.EQUIPMENT_RANGE])
+    self.read_staff(staff_rates, values[self.STAFF_RANGE])
+    self.read_consumable(consumable_rates, values[self.CONSUMABLE_RANGE])
     for id in self.hospitals["ids"]:
-      self.read_hospital_equipment(id)
-      self.read_hospital_staff(id)
-      self.read_hospital_consumable(id)
-    
+      self.read_hospital_equipment(id, values[self.hospital_equipment_range(id)])
+      self.read_hospital_staff(id, values[self.hospital_staff_range(id)])
+      self.read_hospital_consumable(id, values[self.hospital_consumable_range(id)])
+
+  def load_ranges(self):
+    if self.snapshot is None:
+      return self.fetch_ranges()
+    with self.snapshot.lock:
+      if self.snapshot.is_fresh():
+        return self.snapshot.load()
+      values = self.fetch_ranges()
+      self.snapshot.store(values)
+      return values
+
+  def fetch_ranges(self):
+    start = time.perf_counter()
+    # The general tabs come in one request; the per-hospital tab names depend on
+    # the hospital names, so they come in a second one.
+    values = self.get_ranges([self.HOSPITAL_RANGE, self.EQUIPMENT_RANGE, self.STAFF_RANGE,
+      self.CONSUMABLE_RANGE])
+    hospital_ranges = []
+    for row in values[self.HOSPITAL_RANGE]:
+      hospital_ranges += self.hospital_ranges(row[1])
+    values.update(self.get_ranges(hospital_ranges))
+    print("Spreadsheet read in {:.3f}s, Sheets API totals: {}".format(
+      time.perf_counter() - start, self.client.stats()))
+    return values
+
+  def __getstate__(self):
+    # Only the parsed data is pickled (e.g. to solve scenarios in worker processes);
+    # the client and the snapshot hold locks and stay in this process
+    state = self.__dict__.copy()
+    state["client"] = None
+    state["snapshot"] = None
+    return state
+
+  def hospital_ranges(self, hospital_name):
+    return [hospital_name + " - Equipamento!A2:D", hospital_name + " - Profissional!A2:C",
+      hospital_name + " - Insumo!A2:C"]
+
+  def hospital_equipment_range(self, hospital_id):
+    return self.hospital_ranges(self.hospitals["names"][hospital_id])[0]
+
+  def hospital_staff_range(self, hospital_id):
+    return self.hospital_ranges(self.hospitals["names"][hospital_id])[1]
+
+  def hospital_consumable_range(self, hospital_id):
+    return self.hospital_ranges(self.hospitals["names"][hospital_id])[2]
+
+  def get_ranges(self, range_names):
+    # Returns {<range name>: <rows>}, with [] for empty ranges, whatever the fetch mode
+    if self.fetch_mode == "batch":
+      return self.batch_get_ranges(range_names)
+    if self.fetch_mode == "concurrent":
+      return self.concurrent_get_ranges(range_names)
+    return {range_name: self.get_range(range_name) for range_name in range_names}
+
+  def get_range(self, range_name):
+    result = self.client.execute(
+      lambda service: service.spreadsheets().values()
+        .get(spreadsheetId=self.spreadsheet_id, range=range_name),
+      "values.get")
+    return result.get("values", [])
+
+  def concurrent_get_ranges(self, range_names):
+    # Wall-clock time is set by the slowest range; the pool size bounds the request
+    # rate, and rate-limited calls back off inside SheetsClient.execute
+    rows = self.client.executor().map(self.get_range, range_names)
+    return dict(zip(range_names, rows))
+
+  def batch_get_ranges(self, range_names):
+    # Returns {<range name>: <rows>}, with [] for empty ranges
+    values = {}
+    for start in range(0, len(range_names), self.BATCH_SIZE):
+      chunk = range_names[start:start + self.BATCH_SIZE]
+      result = self.client.execute(
+        lambda service: service.spreadsheets().values()
+          .batchGet(spreadsheetId=self.spreadsheet_id, ranges=chunk),
+        "values.batchGet")
+      # valueRanges come back in the same order as the requested ranges
+      for range_name, value_range in zip(chunk, result.get("valueRanges", [])):
+        values[range_name] = value_range.get("values", [])
+    for range_name in range_names:
+      values.setdefault(range_name, [])
+    return values
+
   def connect_range(self, range_name):
     try:
-      service = build("sheets", "v4", credentials=self.creds)
       # Call the Sheets API
-      sheet = service.spreadsheets()
-      result = (
-          sheet.values()
-          .get(spreadsheetId=self.spreadsheet_id, range=range_name)
-          .execute()
-      )
-      values = result.get("values", [])
+      values = self.get_range(range_name)
       if not values:
         print("No data found.")
         return
@@ -98,8 +188,9 @@ class ReadData:
     except HttpError as err:
       print(err)
 
-  def read_hospital(self):
-    values = self.connect_range("Hospital!A2:H")
+  def read_hospital(self, values = None):
+    if values is None:
+      values = self.connect_range(self.HOSPITAL_RANGE)
     for row in values:
       id = int(row[0])
       self.hospitals["ids"].append(id)
@@ -112,63 +203,66 @@ class ReadData:
       self.hospitals["coord_y"][id] = float(row[6].replace(",", "."))
       self.hospitals["built"][id] = row[7] == "Construído"
 
-  def read_equipment(self, equipment_rates = None):
-    values = self.connect_range("Equipamento!A2:F")
+  def read_equipment(self, equipment_rates = None, values = None):
+    if values is None:
+      values = self.connect_range(self.EQUIPMENT_RANGE)
     for row in values:
       id = int(row[0])
       self.equipments["ids"].append(id)
       self.equipments["names"][id] = row[1]
       self.equipments["prices"][id] = float(
         row[2].replace("R$ ", "").replace(".", "").replace(",", "."))
-      if equipment_rates and id in equipment_rates.keys():
-        self.equipments["necessary_rates"][id] = equipment_rates[id]
-      else:
-        self.equipments["necessary_rates"][id] = float(row[3])
+      self.equipments["default_rates"][id] = float(row[3])
+      self.equipments["necessary_rates"][id] = self.get_equipment_necessary_rate(id,
+        equipment_rates or {})
       self.equipments["maintenance_freqs"][id] = int(row[4])
       self.equipments["maintenance_costs"][id] = float(
         row[5].replace("R$ ", "").replace(".", "").replace(",", "."))
 
-  def read_staff(self, staff_rates = None):
-    values = self.connect_range("Profissional!A2:E")
+  def read_staff(self, staff_rates = None, values = None):
+    if values is None:
+      values = self.connect_range(self.STAFF_RANGE)
     for row in values:
       id = int(row[0])
       self.staff["ids"].append(id)
       self.staff["teams"][id] = row[1]
       self.staff["salaries"][id] = float(
         row[2].replace("R$ ", "").replace(".", "").replace(",", "."))
-      if staff_rates and id in staff_rates.keys():
-        self.staff["necessary_rates"][id] = math.ceil(7*24/int(row[3]))*staff_rates[id]
-      else:
-        self.staff["necessary_rates"][id] = math.ceil(7*24/int(row[3]))*float(row[4].replace(",", "."))
+      self.staff["shift_hours"][id] = int(row[3])
+      self.staff["default_rates"][id] = float(row[4].replace(",", "."))
+      self.staff["necessary_rates"][id] = self.get_staff_necessary_rate(id, staff_rates or {})
 
-  def read_consumable(self, consumable_rates = None):
-    values = self.connect_range("Insumo!A2:E")
+  def read_consumable(self, consumable_rates = None, values = None):
+    if values is None:
+      values = self.connect_range(self.CONSUMABLE_RANGE)
     for row in values:
       id = int(row[0])
       self.consumables["ids"].append(id)
       self.consumables["names"][id] = row[1]
       self.consumables["prices"][id] = float(
         row[2].replace("R$ ", "").replace(".", "").replace(",", "."))
-      if consumable_rates and id in consumable_rates.keys():
-        self.consumables["necessary_rates"][id] = consumable_rates[id]
-      else:
-        self.consumables["necessary_rates"][id] = float(row[4])
+      self.consumables["default_rates"][id] = float(row[4])
+      self.consumables["necessary_rates"][id] = self.get_consumable_necessary_rate(id,
+        consumable_rates or {})
 
-  def read_hospital_equipment(self, hospital_id):
-    values = self.connect_range(self.hospitals["names"][hospital_id] + " - Equipamento!A2:D")
+  def read_hospital_equipment(self, hospital_id, values = None):
+    if values is None:
+      values = self.connect_range(self.hospital_equipment_range(hospital_id))
     self.hospital_equipments[hospital_id] = {}
     for row in values:
       self.hospital_equipments[hospital_id][int(row[0])] = [int(row[2]), int(row[3])]
         # [<total quantity>, <needing maintenance>]
 
-  def read_hospital_staff(self, hospital_id):
-    values = self.connect_range(self.hospitals["names"][hospital_id] + " - Profissional!A2:C")
+  def read_hospital_staff(self, hospital_id, values = None):
+    if values is None:
+      values = self.connect_range(self.hospital_staff_range(hospital_id))
     self.hospital_staff[hospital_id] = {}
     for row in values:
       self.hospital_staff[hospital_id][int(row[0])] = int(row[2])
   
-  def read_hospital_consumable(self, hospital_id):
-    values = self.connect_range(self.hospitals["names"][hospital_id] + " - Insumo!A2:C")
+  def read_hospital_consumable(self, hospital_id, values = None):
+    if values is None:
+      values = self.connect_range(self.hospital_consumable_range(hospital_id))
     self.hospital_consumables[hospital_id] = {}
     for row in values:
       self.hospital_consumables[hospital_id][int(row[0])] = int(row[2])
@@ -203,8 +297,13 @@ class ReadData:
   def get_equipment_price(self, id):
     return self.equipments["prices"][id]
   
-  def get_equipment_necessary_rate(self, id):
-    return self.equipments["necessary_rates"][id]
+  def get_equipment_necessary_rate(self, id, equipment_rates = None):
+    # equipment_rates overrides the spreadsheet rates, as in the constructor
+    if equipment_rates is None:
+      return self.equipments["necessary_rates"][id]
+    if id in equipment_rates.keys():
+      return equipment_rates[id]
+    return self.equipments["default_rates"][id]
   
   def get_equipment_maintenance_freq(self, id):
     return self.equipments["maintenance_freqs"][id]
@@ -221,8 +320,13 @@ class ReadData:
   def get_staff_salary(self, id):
     return self.staff["salaries"][id]
   
-  def get_staff_necessary_rate(self, id):
-    return self.staff["necessary_rates"][id]
+  def get_staff_necessary_rate(self, id, staff_rates = None):
+    # staff_rates overrides the spreadsheet rates, as in the constructor
+    if staff_rates is None:
+      return self.staff["necessary_rates"][id]
+    if id in staff_rates.keys():
+      return math.ceil(7*24/self.staff["shift_hours"][id])*staff_rates[id]
+    return math.ceil(7*24/self.staff["shift_hours"][id])*self.staff["default_rates"][id]
   
   def get_consumable_ids(self):
     return self.consumables["ids"]
@@ -233,8 +337,13 @@ class ReadData:
   def get_consumable_price(self, id):
     return self.consumables["prices"][id]
   
-  def get_consumable_necessary_rate(self, id):
-    return self.consumables["necessary_rates"][id]
+  def get_consumable_necessary_rate(self, id, consumable_rates = None):
+    # consumable_rates overrides the spreadsheet rates, as in the constructor
+    if consumable_rates is None:
+      return self.consumables["necessary_rates"][id]
+    if id in consumable_rates.keys():
+      return consumable_rates[id]
+    return self.consumables["default_rates"][id]
   
   def get_equipment_quantity(self, hospital_id, equipment_id):
     return (self.hospital_equipments[hospital_id][equipment_id][0] -
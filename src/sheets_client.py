@@ -0,0 +1,165 @@
+import os.path
+import time
+import random
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+class SheetsClient:
+  # If modifying these scopes, delete the file token.json.
+  SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+  TOKEN_FILE = os.path.join("src","data","token.json")
+  CREDENTIALS_FILE = os.path.join("src","data","credentials.json")
+  REFRESH_MARGIN = 5*60 # refresh the access token when it expires in less than this many seconds
+  RETRY_STATUSES = (429, 500, 502, 503, 504) # rate limited or transient server errors
+  MAX_RETRIES = 5
+  BACKOFF = 1.0 # seconds before the first retry, doubled on each attempt
+  MAX_WORKERS = 8 # threads of the pool that runs concurrent reads
+
+  def __init__(self, service = None):
+    # A prebuilt service (e.g. a local fake of the Sheets API) is shared by every
+    # thread and skips authentication
+    self.shared_service = service
+    self.creds = None
+    self.creds_lock = threading.Lock()
+    # The service is built once and shared; httplib2 connections are not thread-safe,
+    # so each thread executes its requests with its own AuthorizedHttp
+    self.built_service = None
+    self.service_lock = threading.Lock()
+    self.local = threading.local()
+    # Long-lived, so that its threads keep their connections between reads
+    self.pool = None
+    self.pool_lock = threading.Lock()
+
+    self.stats_lock = threading.Lock()
+    self.calls = {}
+    self.call_time = {}
+
+  def credentials(self):
+    with self.creds_lock:
+      if self.creds is None:
+        self.creds = self.load_credentials()
+      elif self.needs_refresh():
+        self.creds.refresh(Request())
+        self.save_credentials()
+      return self.creds
+
+  def load_credentials(self):
+    creds = None
+    # The file token.json stores the user's access and refresh tokens, and is
+    # created automatically when the authorization flow completes for the first
+    # time.
+    if os.path.exists(self.TOKEN_FILE):
+      creds = Credentials.from_authorized_user_file(self.TOKEN_FILE, self.SCOPES)
+    # If there are no (valid) credentials available, let the user log in.
+    if not creds or not creds.valid:
+      if creds and creds.expired and creds.refresh_token:
+        creds.refresh(Request())
+      else:
+        flow = InstalledAppFlow.from_client_secrets_file(self.CREDENTIALS_FILE, self.SCOPES)
+        creds = flow.run_local_server(port=0)
+      self.creds = creds
+      # Save the credentials for the next run
+      self.save_credentials()
+    return creds
+
+  def save_credentials(self):
+    with open(self.TOKEN_FILE, "w") as token:
+      token.write(self.creds.to_json())
+
+  def needs_refresh(self):
+    if not self.creds.valid:
+      return True
+    if self.creds.expiry is None:
+      return False
+    # google-auth keeps expiry as a naive UTC datetime
+    remaining = self.creds.expiry - datetime.datetime.utcnow()
+    return remaining < datetime.timedelta(seconds=self.REFRESH_MARGIN)
+
+  def service(self):
+    if self.shared_service is not None:
+      return self.shared_service
+    with self.service_lock:
+      if self.built_service is None:
+        self.built_service = build("sheets", "v4", credentials=self.credentials())
+      return self.built_service
+
+  def http(self):
+    # This thread's connection, authorized with the shared (and refreshed) credentials
+    creds = self.credentials()
+    http = getattr(self.local, "http", None)
+    if http is None:
+      http = AuthorizedHttp(creds, http=httplib2.Http())
+      self.local.http = http
+    return http
+
+  def executor(self):
+    with self.pool_lock:
+      if self.pool is None:
+        self.pool = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+      return self.pool
+
+  def run(self, request):
+    if self.shared_service is not None:
+      return request.execute()
+    return request.execute(http=self.http())
+
+  def execute(self, make_request, name = "request"):
+    # make_request receives the service and returns the request to run
+    attempt = 0
+    while True:
+      start = time.perf_counter()
+      try:
+        return self.run(make_request(self.service()))
+      except HttpError as err:
+        if err.resp.status not in self.RETRY_STATUSES or attempt >= self.MAX_RETRIES:
+          raise
+        delay = self.retry_delay(err, attempt)
+        print("Sheets API returned", err.resp.status, "- retrying", name, "in",
+          round(delay, 2), "s")
+        attempt += 1
+      finally:
+        elapsed = time.perf_counter() - start
+        with self.stats_lock:
+          self.calls[name] = self.calls.get(name, 0) + 1
+          self.call_time[name] = self.call_time.get(name, 0.0) + elapsed
+      time.sleep(delay)
+
+  def retry_delay(self, err, attempt):
+    # Honour the server's Retry-After when present, otherwise exponential backoff
+    # with jitter so that concurrent workers do not retry in lockstep
+    retry_after = err.resp.get("retry-after")
+    if retry_after is not None:
+      try:
+        return float(retry_after)
+      except ValueError:
+        pass
+    return self.BACKOFF*2**attempt + random.uniform(0, self.BACKOFF)
+
+  def stats(self):
+    with self.stats_lock:
+      return {name: {"calls": self.calls[name], "seconds": self.call_time[name]}
+        for name in self.calls}
+
+  def reset_stats(self):
+    with self.stats_lock:
+      self.calls = {}
+      self.call_time = {}
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+def get_default_client():
+  global _default_client
+  with _default_client_lock:
+    if _default_client is None:
+      _default_client = SheetsClient()
+    return _default_client
@@ -0,0 +1,103 @@
+"""Local SQLite copy of the planning spreadsheet, served for TTL seconds.
+
+When the TTL expires, every tab is read again from the spreadsheet: the Sheets API
+has no per-tab revision or modification time to ask for first. Only the tabs whose
+content digest changed are rewritten in the snapshot, and the version seen by the
+solution cache changes only then, but the refresh traffic is always the whole
+spreadsheet.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from .files import data_path
+
+class SheetsSnapshot:
+  TTL = 10*60 # seconds during which a snapshot is served without contacting the spreadsheet
+
+  def __init__(self, file = os.path.join(data_path, 'sheets_snapshot.db'), ttl = None):
+    self.file = file
+    self.ttl = self.TTL if ttl is None else ttl
+    # Held while checking and refreshing, so concurrent requests refresh only once
+    self.lock = threading.RLock()
+
+    with self.connect() as conn:
+      conn.execute("""create table if not exists tabs (
+        range_name text primary key,
+        rows text not null,
+        digest text not null,
+        updated_at real not null)""")
+      conn.execute("create table if not exists meta (key text primary key, value text not null)")
+
+  def connect(self):
+    return sqlite3.connect(self.file, timeout=30)
+
+  def digest(self, rows):
+    return hashlib.sha256(json.dumps(rows).encode("utf-8")).hexdigest()
+
+  def get_meta(self, conn, key):
+    row = conn.execute("select value from meta where key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+  def refreshed_at(self):
+    with self.connect() as conn:
+      value = self.get_meta(conn, "refreshed_at")
+    return float(value) if value is not None else None
+
+  def is_fresh(self):
+    refreshed_at = self.refreshed_at()
+    return refreshed_at is not None and time.time() - refreshed_at < self.ttl
+
+  def version(self):
+    with self.connect() as conn:
+      return self.get_meta(conn, "version")
+
+  def load(self):
+    # Returns {<range name>: <rows>} as stored by the last refresh
+    with self.connect() as conn:
+      return {range_name: json.loads(rows) for range_name, rows in
+        conn.execute("select range_name, rows from tabs")}
+
+  def store(self, values):
+    # values holds every tab, freshly read. Rewrites only the tabs whose content
+    # changed since the last refresh and drops tabs that are no longer read (e.g. a
+    # removed hospital)
+    now = time.time()
+    changed = []
+    with self.connect() as conn:
+      stored = dict(conn.execute("select range_name, digest from tabs"))
+      for range_name, rows in values.items():
+        digest = self.digest(rows)
+        if stored.get(range_name) != digest:
+          conn.execute("insert or replace into tabs values (?, ?, ?, ?)",
+            (range_name, json.dumps(rows), digest, now))
+          changed.append(range_name)
+      removed = [range_name for range_name in stored if range_name not in values]
+      conn.executemany("delete from tabs where range_name = ?", [(r,) for r in removed])
+
+      if changed or removed or self.get_meta(conn, "version") is None:
+        digests = sorted(conn.execute("select range_name, digest from tabs"))
+        version = hashlib.sha256(json.dumps(digests).encode("utf-8")).hexdigest()
+        conn.execute("insert or replace into meta values ('version', ?)", (version,))
+      conn.execute("insert or replace into meta values ('refreshed_at', ?)", (str(now),))
+    if changed or removed:
+      print("Snapshot updated:", len(changed), "tabs changed,", len(removed), "tabs removed")
+    return changed
+
+  def invalidate(self):
+    # Forces the next read to go to the spreadsheet
+    with self.connect() as conn:
+      conn.execute("delete from meta where key = 'refreshed_at'")
+
+_default_snapshot = None
+_default_snapshot_lock = threading.Lock()
+
+def get_default_snapshot():
+  global _default_snapshot
+  with _default_snapshot_lock:
+    if _default_snapshot is None:
+      _default_snapshot = SheetsSnapshot()
+    return _default_snapshot
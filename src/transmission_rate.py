@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import gamma
+
+from .cache import LRUCache
+
+class TransmissionRate:
+    # Effective reproduction number R_t from daily cases with the renewal model of
+    # Cori et al. (2013): cases I_t ~ Poisson(R_t * Lambda_t), where
+    # Lambda_t = sum_k w_k I_{t-k} weights past cases by the serial interval w.
+    # With a Gamma(prior_shape, prior_scale) prior and R_t constant over the last
+    # `window` days, the posterior mean is (a + sum I) / (1/b + sum Lambda).
+    # Every RA is estimated at once on a dates x RAs matrix.
+    def __init__(self, mean=4.7, sd=2.9, max_lag=21, window=7, prior_shape=1.0, prior_scale=5.0,
+                 max_entries=8):
+        self.mean = mean # serial interval of COVID-19 in days (Nishiura et al., 2020)
+        self.sd = sd
+        self.max_lag = max_lag
+        self.window = window
+        self.prior_shape = prior_shape
+        self.prior_scale = prior_scale
+        self.weights = self.serial_interval()
+        self.cache = LRUCache(max_entries)
+
+    def serial_interval(self):
+        # Gamma distribution discretized over 1..max_lag days: w_k = P(k-1 < S <= k)
+        shape = (self.mean/self.sd)**2
+        scale = self.sd**2/self.mean
+        weights = np.diff(gamma.cdf(np.arange(self.max_lag + 1), shape, scale=scale))
+        return weights/weights.sum()
+
+    def window_sum(self, values):
+        sums = np.cumsum(values, axis=0)
+        sums[self.window:] = sums[self.window:] - sums[:-self.window]
+        sums[:self.window - 1] = np.nan # incomplete windows
+        return sums
+
+    def estimate(self, cases, version=None):
+        # cases has unique_id, ds and y columns. Returns unique_id, ds and rt, with
+        # NaN where there were no earlier cases to estimate from. Results are kept
+        # by version, so each version of the data is only estimated once.
+        if version is not None:
+            rates = self.cache.get(version)
+            if rates is not None:
+                return rates
+
+        incidence = cases.pivot_table(index='ds', columns='unique_id', values='y', aggfunc='sum')
+        days = pd.date_range(incidence.index.min(), incidence.index.max(), freq='D', name='ds')
+        incidence = incidence.reindex(days).fillna(0)
+        counts = np.clip(incidence.to_numpy(dtype=float), 0, None)
+
+        # Convolution of each RA's series with the serial interval, one lag at a time
+        infectiousness = np.zeros_like(counts)
+        for lag, weight in enumerate(self.weights, start=1):
+            infectiousness[lag:] += weight*counts[:-lag]
+
+        cases_window = self.window_sum(counts)
+        infectiousness_window = self.window_sum(infectiousness)
+        with np.errstate(invalid='ignore'):
+            rt = (self.prior_shape + cases_window)/(1/self.prior_scale + infectiousness_window)
+        rt[~(infectiousness_window > 0)] = np.nan
+
+        rates = pd.DataFrame(rt, index=incidence.index, columns=incidence.columns).reset_index()
+        rates = rates.melt(id_vars='ds', var_name='unique_id', value_name='rt')[['unique_id', 'ds', 'rt']]
+        if version is not None:
+            self.cache.put(version, rates)
+        return rates
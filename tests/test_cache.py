@@ -0,0 +1,43 @@
+import os
+import threading
+
+from src.cache import SolutionCache
+
+def test_version_bump_drops_the_disk_tier(tmp_path):
+  disk_path = str(tmp_path/"solution_cache")
+  cache = SolutionCache(disk_path=disk_path)
+  cache.check_version("v1")
+  key = cache.key({"demand": 65}, "v1")
+  cache.put(key, "<html>v1</html>")
+  assert os.path.exists(os.path.join(disk_path, key))
+
+  # A restart with the same inputs still finds the entry on disk
+  assert SolutionCache(disk_path=disk_path).get(key) == "<html>v1</html>"
+
+  cache.check_version("v2")
+  assert cache.get(key) is None
+  assert sorted(os.listdir(disk_path)) == ["VERSION"]
+  # ...and so does a restart after the bump
+  restarted = SolutionCache(disk_path=disk_path)
+  assert restarted.version == "v2"
+  assert restarted.get(key) is None
+
+def test_put_survives_a_concurrent_version_bump(tmp_path):
+  cache = SolutionCache(disk_path=str(tmp_path/"solution_cache"))
+  errors = []
+
+  def put(worker):
+    try:
+      for i in range(200):
+        cache.put(cache.key({"worker": worker, "i": i}, cache.version), "x"*1024)
+    except Exception as err:
+      errors.append(err)
+
+  threads = [threading.Thread(target=put, args=(worker,)) for worker in range(4)]
+  for thread in threads:
+    thread.start()
+  for version in range(200):
+    cache.check_version(str(version))
+  for thread in threads:
+    thread.join()
+  assert errors == []
@@ -0,0 +1,99 @@
+import os
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# create_data.py and create_db.py are scripts run from src/ and import each other
+# as top-level modules
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+RAS = ['Plano Piloto', 'Ceilândia', 'Gama', 'Não Informado', 'Entorno DF']
+
+def open_data_rows(rng, n, start, days):
+    # Rows shaped like dados-abertos.csv, with first symptoms in [start, start + days)
+    first_symptoms = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit='D')
+    return pd.DataFrame({
+        'UF': 'DF',
+        'RA': rng.choice(RAS, n),
+        'Óbito': np.where(rng.random(n) < 0.1, 'Sim', 'Não'),
+        'dataPrimeirosintomas': first_symptoms.strftime('%d/%m/%Y'),
+    })
+
+@pytest.fixture
+def create_data(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(SRC)
+    module = importlib.import_module('create_data')
+    monkeypatch.setattr(module, 'csv_file', str(tmp_path/'dados-abertos.csv'))
+    monkeypatch.setattr(module, 'database_file', str(tmp_path/'covid_data.db'))
+    monkeypatch.setattr(module, 'output_file', str(tmp_path/'dados-gerais.csv'))
+    return module
+
+@pytest.fixture
+def appends(create_data, monkeypatch):
+    # append flag of every write of dados-gerais.csv
+    calls = []
+    write_csv = create_data.write_csv
+    def record(df, append=False):
+        calls.append(append)
+        write_csv(df, append)
+    monkeypatch.setattr(create_data, 'write_csv', record)
+    return calls
+
+def append_rows(create_data, rows):
+    rows.to_csv(create_data.csv_file, sep=';', index=False, header=False, mode='a')
+
+def read_output(create_data):
+    return pd.read_csv(create_data.output_file).sort_values(['date', 'ra']).reset_index(drop=True)
+
+def full_rebuild(create_data, tmp_path, monkeypatch):
+    # dados-gerais.csv built from scratch from the current dados-abertos.csv
+    rebuild = tmp_path/'rebuild'
+    rebuild.mkdir()
+    monkeypatch.setattr(create_data, 'database_file', str(rebuild/'covid_data.db'))
+    monkeypatch.setattr(create_data, 'output_file', str(rebuild/'dados-gerais.csv'))
+    create_data.refresh()
+    return read_output(create_data)
+
+def test_incremental_refreshes_match_a_full_rebuild(create_data, appends, tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    open_data_rows(rng, 5000, '2021-01-01', 120).to_csv(create_data.csv_file, sep=';', index=False)
+    assert create_data.refresh() == 5000
+    assert appends == [False]
+
+    # Only days after the last export: appended to dados-gerais.csv
+    append_rows(create_data, open_data_rows(rng, 300, '2021-05-01', 5))
+    assert create_data.refresh() == 300
+    assert appends == [False, True]
+
+    # Late reports for days already exported: rewritten from the aggregates
+    append_rows(create_data, open_data_rows(rng, 200, '2021-02-01', 60))
+    assert create_data.refresh() == 200
+    assert appends == [False, True, False]
+
+    # Nothing new: the file is left alone
+    assert create_data.refresh() == 0
+    assert appends == [False, True, False]
+
+    incremental = read_output(create_data)
+    pd.testing.assert_frame_equal(incremental, full_rebuild(create_data, tmp_path, monkeypatch))
+    assert incremental['case_cnt'].sum() > 0
+
+def test_replaced_csv_is_rebuilt(create_data, appends, tmp_path, monkeypatch):
+    rng = np.random.default_rng(1)
+    open_data_rows(rng, 2000, '2021-01-01', 60).to_csv(create_data.csv_file, sep=';', index=False)
+    create_data.refresh()
+
+    # Longer than before, but not an append: earlier rows changed too, so the tail
+    # digest differs
+    append_rows(create_data, open_data_rows(rng, 100, '2021-03-05', 3))
+    with open(create_data.csv_file, 'rb') as f:
+        content = f.read()
+    with open(create_data.csv_file, 'wb') as f:
+        f.write(content.replace('Gama'.encode(), 'Lago'.encode()))
+    assert create_data.refresh() == 2100
+    assert appends == [False, False]
+
+    output = read_output(create_data)
+    assert 'gama' not in set(output['ra']) and 'lago' in set(output['ra'])
+    pd.testing.assert_frame_equal(output, full_rebuild(create_data, tmp_path, monkeypatch))
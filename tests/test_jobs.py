@@ -0,0 +1,27 @@
+import time
+import threading
+
+from src.jobs import JobQueue
+
+def wait_until_finished(queue, job, timeout = 60):
+  deadline = time.time() + timeout
+  while not queue.get(job.id).finished():
+    assert time.time() < deadline, "job did not finish"
+    time.sleep(0.05)
+  return queue.get(job.id)
+
+def test_a_job_that_cannot_start_fails_and_the_worker_goes_on():
+  # One worker, so the second job only runs if the first one did not kill it
+  jobs = JobQueue({"echo": dict}, max_workers=1)
+  try:
+    # A lock cannot be pickled to the job process
+    bad = wait_until_finished(jobs, jobs.submit("echo", {"lock": threading.Lock()}))
+    assert bad.status == "failed"
+    assert "pickle" in bad.error
+    assert bad.process is None
+
+    good = wait_until_finished(jobs, jobs.submit("echo", {"demand": 65}))
+    assert good.status == "done"
+    assert good.result == {"demand": 65}
+  finally:
+    jobs.shutdown()
@@ -0,0 +1,62 @@
+import copy
+
+import pytest
+import pyomo.environ as pyo
+
+from src.min_costs_icu_beds import Model, MatrixModel, PersistentModel, transfer_arcs
+from src.benchmarks import SyntheticData
+
+SIZE = 6
+
+@pytest.fixture(scope="module")
+def data():
+  return SyntheticData(SIZE)
+
+@pytest.fixture(scope="module")
+def pyomo_model(data):
+  return Model(data)
+
+def objective(model):
+  return pyo.value(model.model.objective)
+
+def test_matrix_model_matches_pyomo_model(data, pyomo_model):
+  matrix_model = MatrixModel(data)
+  assert pyomo_model.status == matrix_model.status == "optimal"
+  assert objective(matrix_model) == pytest.approx(objective(pyomo_model))
+
+  # The solution read back from HiGHS satisfies the demand and the bed limits
+  solution = matrix_model.extract_solution()
+  assert sum(facility["x"] for facility in solution) >= data.d
+  for facility in solution:
+    assert facility["x"] <= data.u[facility["facility"]]*facility["y"]
+
+def test_stock_arcs_keep_the_complete_graph_optimum(data, pyomo_model):
+  complete = transfer_arcs(data, complete=True)
+  stock = transfer_arcs(data)
+  assert len(complete) == len(data.R + data.U)*SIZE*(SIZE - 1)
+  assert set(stock) < set(complete)
+  assert all(data.a[i][j] > 0 for j, i, l in stock)
+
+  # pyomo_model is built on the stock-only arcs, the default
+  complete_model = Model(data, {"complete": True})
+  assert complete_model.status == pyomo_model.status == "optimal"
+  assert objective(pyomo_model) == pytest.approx(objective(complete_model))
+
+def test_updated_persistent_model_matches_a_fresh_build(data):
+  persistent = PersistentModel()
+  model = persistent.solve(data)
+  base_objective = objective(model)
+
+  scenario = copy.copy(data)
+  scenario.d = data.d + 5
+  scenario.n = list(data.n)
+  scenario.n[data.U[0]] *= 1.2
+  # Same structure, so the model is updated in place instead of rebuilt
+  assert persistent.solve(scenario) is model
+  assert model.build_time == 0
+
+  fresh = Model(scenario)
+  assert model.status == fresh.status == "optimal"
+  assert objective(model) == pytest.approx(objective(fresh))
+  assert objective(model) > base_objective
+  assert sum(facility["x"] for facility in model.extract_solution()) >= scenario.d
@@ -0,0 +1,169 @@
+import time
+import threading
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src import sheets_client
+from src.read_data import ReadData
+
+HOSPITALS = [
+  ["1", "Hospital A", "R$ 0,00", "10", "50", "-15,8", "-47,9", "Construído"],
+  ["2", "Hospital B", "R$ 1.500.000,00", "5", "30", "-15,7", "-48,1", "Não construído"],
+  ["3", "Hospital C", "R$ 0,00", "8", "40", "-15,9", "-48,0", "Construído"],
+]
+TABS = {
+  "Hospital!A2:H": HOSPITALS,
+  "Equipamento!A2:F": [
+    ["0", "Oxímetro", "R$ 150,00", "1", "12", "R$ 30,00"],
+    ["1", "Ventilador", "R$ 45.000,00", "1", "6", "R$ 2.500,00"],
+  ],
+  "Profissional!A2:E": [
+    ["0", "Enfermagem", "R$ 3.200,00", "12", "0,5"],
+    ["1", "Médicos", "R$ 15.000,00", "24", "0,1"],
+  ],
+  "Insumo!A2:E": [
+    ["0", "Midazolam", "R$ 12,50", "ampola", "180"],
+  ],
+}
+for hospital_id, name, *_ in HOSPITALS:
+  TABS[name + " - Equipamento!A2:D"] = [["0", "Oxímetro", "20", hospital_id], ["1", "Ventilador", "8", "1"]]
+  TABS[name + " - Profissional!A2:C"] = [["0", "Enfermagem", str(40 + int(hospital_id))], ["1", "Médicos", "12"]]
+  # An empty tab comes back without "values"
+  TABS[name + " - Insumo!A2:C"] = [] if hospital_id == "3" else [["0", "Midazolam", "500"]]
+
+PARSED = ["hospitals", "equipments", "staff", "consumables", "hospital_equipments", "hospital_staff",
+  "hospital_consumables", "version"]
+
+def http_error(status, retry_after = None):
+  headers = {"status": status}
+  if retry_after is not None:
+    headers["retry-after"] = retry_after
+  return HttpError(httplib2.Response(headers), b"{}")
+
+class FakeRequest:
+  def __init__(self, run):
+    self.run = run
+
+  def execute(self, **kwargs):
+    return self.run()
+
+class FakeSheetsService:
+  # In-memory stand-in for the Sheets API: every range read sleeps for its latency
+  # (default_latency unless given in latencies) and, while failures has errors
+  # queued for a range, raises the next one instead of answering
+  def __init__(self, tabs = TABS, default_latency = 0.0, latencies = None, failures = None):
+    self.tabs = tabs
+    self.default_latency = default_latency
+    self.latencies = latencies or {}
+    self.failures = {range_name: list(errors) for range_name, errors in (failures or {}).items()}
+    self.lock = threading.Lock()
+    self.calls = []
+
+  def spreadsheets(self):
+    return self
+
+  def values(self):
+    return self
+
+  def read(self, range_name):
+    with self.lock:
+      self.calls.append(range_name)
+      error = self.failures[range_name].pop(0) if self.failures.get(range_name) else None
+    if error is not None:
+      raise error
+    threading.Event().wait(self.latencies.get(range_name, self.default_latency))
+    value_range = {"range": range_name}
+    if self.tabs[range_name]:
+      value_range["values"] = self.tabs[range_name]
+    return value_range
+
+  def get(self, spreadsheetId, range):
+    return FakeRequest(lambda: self.read(range))
+
+  def batchGet(self, spreadsheetId, ranges):
+    def run():
+      return {"valueRanges": [self.read(range_name) for range_name in ranges]}
+    return FakeRequest(run)
+
+@pytest.fixture
+def sleeps(monkeypatch):
+  # Backoff delays requested by SheetsClient, without actually waiting
+  delays = []
+  monkeypatch.setattr(sheets_client.time, "sleep", delays.append)
+  monkeypatch.setattr(sheets_client.random, "uniform", lambda a, b: 0.0)
+  return delays
+
+def parsed(data):
+  return {name: getattr(data, name) for name in PARSED}
+
+def test_fetch_modes_parse_identically():
+  results = {mode: parsed(ReadData(service=FakeSheetsService(), fetch_mode=mode))
+    for mode in ReadData.FETCH_MODES}
+  assert results["batch"] == results["sequential"]
+  assert results["concurrent"] == results["sequential"]
+  assert results["sequential"]["hospitals"]["ids"] == [1, 2, 3]
+  assert results["sequential"]["hospital_consumables"][3] == {}
+
+def test_batch_mode_chunks_ranges(monkeypatch):
+  monkeypatch.setattr(ReadData, "BATCH_SIZE", 4)
+  service = FakeSheetsService()
+  data = ReadData(service=service)
+  assert parsed(data) == parsed(ReadData(service=FakeSheetsService(), fetch_mode="sequential"))
+  # 4 general tabs in one batch, then 9 hospital tabs in batches of 4
+  assert data.client.stats()["values.batchGet"]["calls"] == 1 + 3
+  assert sorted(service.calls) == sorted(TABS)
+
+def test_injected_service_does_not_use_the_shared_snapshot():
+  assert ReadData(service=FakeSheetsService()).snapshot is None
+
+def test_concurrent_time_is_set_by_the_slowest_tab():
+  slow_tab = "Hospital B - Profissional!A2:C"
+  latencies = {slow_tab: 0.5}
+  default_latency = 0.1
+
+  start = time.perf_counter()
+  ReadData(service=FakeSheetsService(default_latency=default_latency, latencies=latencies),
+    fetch_mode="concurrent")
+  elapsed = time.perf_counter() - start
+
+  # Two rounds (general tabs, then hospital tabs), each as long as its slowest tab
+  total = default_latency*(len(TABS) - 1) + latencies[slow_tab]
+  assert elapsed >= latencies[slow_tab]
+  assert elapsed < default_latency + latencies[slow_tab] + 0.3 < total
+
+def test_retries_rate_limited_and_server_errors(sleeps):
+  range_name = "Hospital A - Equipamento!A2:D"
+  service = FakeSheetsService(failures={range_name: [http_error(429), http_error(503), http_error(500)]})
+  data = ReadData(service=service, fetch_mode="concurrent")
+
+  assert parsed(data) == parsed(ReadData(service=FakeSheetsService(), fetch_mode="sequential"))
+  assert service.calls.count(range_name) == 4
+  # Exponential backoff without jitter (patched out): BACKOFF, 2*BACKOFF, 4*BACKOFF
+  backoff = sheets_client.SheetsClient.BACKOFF
+  assert sleeps == [backoff, 2*backoff, 4*backoff]
+
+def test_honours_retry_after(sleeps):
+  service = FakeSheetsService(failures={"Hospital!A2:H": [http_error(429, retry_after="7")]})
+  ReadData(service=service, fetch_mode="sequential")
+  assert sleeps == [7.0]
+
+def test_gives_up_after_max_retries(sleeps):
+  max_retries = sheets_client.SheetsClient.MAX_RETRIES
+  service = FakeSheetsService(failures={"Insumo!A2:E": [http_error(503)]*(max_retries + 1)})
+  with pytest.raises(HttpError) as err:
+    ReadData(service=service, fetch_mode="concurrent")
+  assert err.value.resp.status == 503
+  assert service.calls.count("Insumo!A2:E") == max_retries + 1
+  assert len(sleeps) == max_retries
+
+@pytest.mark.parametrize("fetch_mode", ReadData.FETCH_MODES)
+@pytest.mark.parametrize("status", [400, 403, 404])
+def test_non_retryable_errors_propagate(sleeps, fetch_mode, status):
+  service = FakeSheetsService(failures={"Equipamento!A2:F": [http_error(status)]})
+  with pytest.raises(HttpError) as err:
+    ReadData(service=service, fetch_mode=fetch_mode)
+  assert err.value.resp.status == status
+  assert service.calls.count("Equipamento!A2:F") == 1
+  assert sleeps == []